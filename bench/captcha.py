@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+验证码识别离线基准测试
+
+对一个录制好的验证码目录跑完整的识别流程（解码、质量门、检测、相似度、分配），
+不访问网络、不启动浏览器，输出识别耗时分位数、各阶段 CPU 时间和准确率。
+
+目录结构（每个样本一个子目录）：
+    corpus/
+        <样本名>/captcha.jpg     背景图 slideBg
+        <样本名>/sprite.jpg      提示图标 instruction
+        <样本名>/answer.json     可选，{"positions": [[x, y], [x, y], [x, y]]}
+                                 按图标顺序给出原图坐标下的正确点击位置
+
+也可以直接传入 CAPTCHA_DATASET_DIR 采集到的数据集目录（含 index.jsonl），
+此时通过验证的轮次以当时的点击位置作为标注，其余轮次只参与耗时统计。
+
+用法：
+    python bench/captcha.py corpus/ [--repeat 3] [--tolerance 20] [--matcher cascade] [--json]
+    python bench/captcha.py corpus/ --matcher all     # 依次对比所有相似度后端
+    python bench/captcha.py corpus/ --preprocess full # 整图预处理一次再切片（CAPTCHA_PREPROCESS）
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rainyun  # noqa: E402
+
+
+def load_dataset(root):
+    """读取 CaptchaRecorder 采集的数据集，同一张背景图只保留一份，优先保留通过验证的记录"""
+    entries = {}
+    with open(os.path.join(root, "index.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if not entry.get("captcha") or not entry.get("sprite"):
+                continue
+            if entry["captcha"] in entries and not entry.get("success"):
+                continue
+            entries[entry["captcha"]] = entry
+
+    def read(digest):
+        with open(os.path.join(root, "objects", digest[:2], digest + ".jpg"), "rb") as f:
+            return f.read()
+
+    samples = []
+    for digest, entry in entries.items():
+        truth = [tuple(p) for p in entry["clicks"]] if entry.get("success") and entry.get("clicks") else None
+        samples.append({"name": digest[:12], "captcha": read(digest), "sprite": read(entry["sprite"]), "truth": truth})
+    return samples
+
+
+def load_samples(corpus):
+    if os.path.isfile(os.path.join(corpus, "index.jsonl")):
+        return load_dataset(corpus)
+    samples = []
+    for name in sorted(os.listdir(corpus)):
+        folder = os.path.join(corpus, name)
+        captcha_path = os.path.join(folder, "captcha.jpg")
+        sprite_path = os.path.join(folder, "sprite.jpg")
+        if not (os.path.isfile(captcha_path) and os.path.isfile(sprite_path)):
+            continue
+        with open(captcha_path, "rb") as f:
+            captcha_b = f.read()
+        with open(sprite_path, "rb") as f:
+            sprite_b = f.read()
+        truth = None
+        answer_path = os.path.join(folder, "answer.json")
+        if os.path.isfile(answer_path):
+            with open(answer_path, "r", encoding="utf-8") as f:
+                truth = [tuple(p) for p in json.load(f)["positions"]]
+        samples.append({"name": name, "captcha": captcha_b, "sprite": sprite_b, "truth": truth})
+    return samples
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def judge(recognition, truth, tolerance):
+    """返回每个图标是否点对；没有标注或没有给出答案时返回 None"""
+    if truth is None or recognition.answer is None:
+        return None
+    return [
+        math.hypot(x - tx, y - ty) <= tolerance
+        for (x, y), (tx, ty) in zip(recognition.answer.positions, truth)
+    ]
+
+
+def run(samples, repeat, tolerance, matcher=None):
+    latencies, stage_wall, stage_cpu = [], {}, {}
+    statuses, per_sample, backends = {}, [], {}
+    labeled = solved = correct = icons_total = icons_correct = 0
+    for sample in samples:
+        for _ in range(repeat):
+            stages, cpu_stages = {}, {}
+            start = time.perf_counter()
+            recognition = rainyun.recognize_captcha(sample["captcha"], sample["sprite"], stages, cpu_stages, matcher)
+            latencies.append(time.perf_counter() - start)
+            for name, seconds in stages.items():
+                stage_wall.setdefault(name, []).append(seconds)
+            for name, seconds in cpu_stages.items():
+                stage_cpu.setdefault(name, []).append(seconds)
+        # 识别结果是确定的，准确率只按最后一轮统计一次
+        statuses[recognition.status] = statuses.get(recognition.status, 0) + 1
+        if recognition.matcher:
+            backends[recognition.matcher] = backends.get(recognition.matcher, 0) + 1
+        verdict = judge(recognition, sample["truth"], tolerance) if recognition.status == "ok" else None
+        if sample["truth"] is not None:
+            labeled += 1
+            if recognition.status == "ok":
+                solved += 1
+            if verdict is not None:
+                icons_total += len(verdict)
+                icons_correct += sum(verdict)
+                correct += all(verdict)
+        per_sample.append({
+            "name": sample["name"],
+            "status": recognition.status,
+            "matcher": recognition.matcher,
+            "boxes": len(recognition.bboxes),
+            "positions": recognition.answer.positions if recognition.answer else None,
+            "margin": recognition.answer.margin if recognition.answer else None,
+            "correct": verdict,
+        })
+
+    return {
+        "matcher": matcher or rainyun.CAPTCHA_MATCHER,
+        "preprocess": rainyun.CAPTCHA_PREPROCESS,
+        "samples": len(samples),
+        "repeat": repeat,
+        "latency": {
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "stages": {
+            name: {
+                "wall_mean": statistics.mean(stage_wall[name]),
+                "wall_p90": percentile(stage_wall[name], 0.9),
+                "cpu_mean": statistics.mean(stage_cpu.get(name, [0.0])),
+            }
+            for name in stage_wall
+        },
+        "status": statuses,
+        "backends": backends,
+        "accuracy": {
+            "labeled": labeled,
+            "answered": solved,
+            # 端到端准确率：三个图标全部点对的样本 / 有标注的样本（未作答算错）
+            "solve_rate": correct / labeled if labeled else None,
+            # 作答准确率：只统计给出了答案的样本
+            "answer_accuracy": correct / solved if solved else None,
+            "icon_accuracy": icons_correct / icons_total if icons_total else None,
+        },
+        "per_sample": per_sample,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="验证码识别离线基准测试")
+    parser.add_argument("corpus", help="样本目录")
+    parser.add_argument("--repeat", type=int, default=1, help="每个样本重复识别的次数")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="点击位置与标注位置的最大允许距离（原图像素）")
+    parser.add_argument("--matcher", help="相似度后端（sift/orb/template/shape/cascade），all 表示逐个对比；默认取 CAPTCHA_MATCHER")
+    parser.add_argument("--preprocess", choices=["crop", "full"], help="预处理方式，默认取 CAPTCHA_PREPROCESS")
+    parser.add_argument("--no-warmup", action="store_true", help="不预热，第一轮计入模型加载时间")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出（包含每个样本的结果）")
+    args = parser.parse_args()
+
+    if args.preprocess:
+        rainyun.CAPTCHA_PREPROCESS = args.preprocess
+    samples = load_samples(args.corpus)
+    if not samples:
+        print(f"{args.corpus} 中没有找到样本")
+        sys.exit(1)
+    if not args.no_warmup:
+        rainyun.recognize_captcha(samples[0]["captcha"], samples[0]["sprite"])
+
+    matchers = list(rainyun.MATCHERS) if args.matcher == "all" else [args.matcher]
+    reports = [run(samples, args.repeat, args.tolerance, matcher) for matcher in matchers]
+    if args.json:
+        print(json.dumps(reports if len(reports) > 1 else reports[0], ensure_ascii=False, indent=2))
+        return
+    for index, report in enumerate(reports):
+        if index:
+            print()
+        print_report(report)
+
+
+def print_report(report):
+    latency = report["latency"]
+    print(f"[{report['matcher']}/{report['preprocess']}] 样本 {report['samples']} 个，每个重复 {report['repeat']} 次")
+    print(f"识别耗时 p50 {latency['p50'] * 1000:.1f} ms | p90 {latency['p90'] * 1000:.1f} ms | "
+          f"p99 {latency['p99'] * 1000:.1f} ms | max {latency['max'] * 1000:.1f} ms")
+    print("各阶段（平均墙钟 / p90 墙钟 / 平均 CPU）:")
+    for name, item in report["stages"].items():
+        print(f"  {name:<8} {item['wall_mean'] * 1000:8.1f} ms {item['wall_p90'] * 1000:8.1f} ms "
+              f"{item['cpu_mean'] * 1000:8.1f} ms")
+    print("识别状态: " + ", ".join(f"{k} {v}" for k, v in sorted(report["status"].items())))
+    if report["backends"]:
+        print("实际使用的后端: " + ", ".join(f"{k} {v}" for k, v in sorted(report["backends"].items())))
+    accuracy = report["accuracy"]
+    if accuracy["labeled"]:
+        def fmt(value):
+            return "-" if value is None else f"{value * 100:.1f}%"
+        print(f"有标注样本 {accuracy['labeled']} 个，作答 {accuracy['answered']} 个 | "
+              f"端到端 {fmt(accuracy['solve_rate'])} | 作答准确率 {fmt(accuracy['answer_accuracy'])} | "
+              f"单图标 {fmt(accuracy['icon_accuracy'])}")
+    else:
+        print("没有标注样本，跳过准确率统计")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+rainyun.py 冷启动基准测试
+
+每一轮都启动一个全新的解释器：
+  1. python -X importtime -c "import rainyun"，统计导入总耗时和各模块的累计导入耗时
+  2. 在没有配置 RAINYUN_USER 的情况下运行 rainyun.py，统计“配置错误直接退出”的总耗时
+
+用法：
+    python bench/startup.py [-n 轮数] [--module notify] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 重点关注的重量级依赖，报告中会单独标出它们是否在启动阶段被导入
+HEAVY_MODULES = ["cv2", "numpy", "ddddocr", "onnxruntime", "selenium", "webdriver_manager", "requests", "PIL"]
+
+
+def clean_env():
+    env = dict(os.environ)
+    # 让“未配置账户”的快速退出路径可复现，同时屏蔽 .env 的影响
+    env["RAINYUN_USER"] = ""
+    env["RAINYUN_PASS"] = ""
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 输出，按输出顺序返回 [(模块名, 自身耗时us, 累计耗时us, 嵌套深度)]
+    """
+    result = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # 模块名前面的缩进表示嵌套深度：一个空格为第 0 层，之后每层多两个空格
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        result.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return result
+
+
+def direct_children(times, module):
+    """
+    被测模块的直接依赖：importtime 先输出子模块再输出父模块，
+    所以从被测模块那一行往前找，直到遇到上一个顶层模块为止。
+    """
+    index = next(i for i, item in enumerate(times) if item[0] == module and item[3] == 0)
+    children = []
+    for name, _, cumulative_us, depth in reversed(times[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((name, cumulative_us))
+    return children
+
+
+def measure_import(module):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=clean_env(), capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def measure_fast_exit():
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "rainyun.py"],
+        cwd=ROOT, env=clean_env(), capture_output=True, text=True,
+    )
+    return time.perf_counter() - start, proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rainyun.py 冷启动基准测试")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="重复次数，取中位数")
+    parser.add_argument("--module", action="append", help="要测量的模块，可重复指定，默认 rainyun 和 notify")
+    parser.add_argument("--top", type=int, default=15, help="每个模块列出的直接依赖数量")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+    modules = args.module or ["rainyun", "notify"]
+
+    report = {"python": sys.version.split()[0], "runs": args.runs, "modules": {}, "fast_exit": {}}
+    for module in modules:
+        walls, totals, children, loaded = [], [], {}, set()
+        for _ in range(args.runs):
+            wall, times = measure_import(module)
+            walls.append(wall)
+            totals.append(next(item[2] for item in times if item[0] == module) / 1e6)
+            loaded.update(item[0].split(".")[0] for item in times)
+            for name, cumulative_us in direct_children(times, module):
+                children.setdefault(name, []).append(cumulative_us / 1e6)
+        ranked = sorted(((statistics.median(v), k) for k, v in children.items()), reverse=True)
+        report["modules"][module] = {
+            "wall_s": statistics.median(walls),
+            "import_s": statistics.median(totals),
+            "heavy_loaded": [m for m in HEAVY_MODULES if m in loaded],
+            "children": [{"module": k, "cumulative_s": v} for v, k in ranked[:args.top]],
+        }
+
+    exits = [measure_fast_exit() for _ in range(args.runs)]
+    report["fast_exit"] = {
+        "wall_s": statistics.median(wall for wall, _ in exits),
+        "returncode": exits[-1][1],
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"Python {report['python']}，每项 {args.runs} 轮，取中位数")
+    for module, item in report["modules"].items():
+        print()
+        print(f"[{module}] 进程总耗时 {item['wall_s'] * 1000:.1f} ms，导入耗时 {item['import_s'] * 1000:.1f} ms")
+        print(f"  启动阶段加载的重量级依赖: {', '.join(item['heavy_loaded']) or '无'}")
+        for child in item["children"]:
+            print(f"  {child['cumulative_s'] * 1000:8.1f} ms  {child['module']}")
+    print()
+    print(f"[rainyun.py 未配置账户直接退出] 总耗时 {report['fast_exit']['wall_s'] * 1000:.1f} ms，"
+          f"退出码 {report['fast_exit']['returncode']}")
+
+
+if __name__ == "__main__":
+    main()
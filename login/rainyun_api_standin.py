@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+雨云接口替身服务
+用途：在本地启动一个模拟雨云 v2 接口的 HTTP 服务，离线检查 rainyun.py 的纯接口签到（RAINYUN_ENGINE=http）
+在各种情况下是否给出正确结果，不会访问真实的雨云接口。
+
+用法：
+    python login/rainyun_api_standin.py
+"""
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "correct-password"
+CSRF_TOKEN = "standin-csrf-token"
+
+
+class Scenario:
+    """
+    单个检查场景的服务端状态
+
+    Args:
+        name: 场景名
+        password: rainyun.py 登录时使用的密码
+        status: 登录后“每日签到”任务的 Status
+        claim_status: 领取接口返回 200 后任务变成的 Status（模拟领取没有真正生效时保持原值）
+        login_message: 不为空时登录接口返回该错误信息
+        expect_ok: 期望 rainyun.py 判定签到成功
+        expect_reason: 失败时原因中应包含的文字
+    """
+
+    def __init__(self, name, password=PASSWORD, status=1, claim_status=2, login_message="", expect_ok=True,
+                 expect_reason=""):
+        self.name = name
+        self.password = password
+        self.status = status
+        self.claim_status = claim_status
+        self.login_message = login_message
+        self.expect_ok = expect_ok
+        self.expect_reason = expect_reason
+        self.claims = 0
+
+
+SCENARIOS = [
+    Scenario("领取成功", status=1),
+    Scenario("已领取", status=2),
+    Scenario("密码错误", password="wrong-password", expect_ok=False, expect_reason="密码错误"),
+    Scenario("需要验证码", login_message="请先完成人机验证", expect_ok=False, expect_reason="验证码"),
+    Scenario("领取未生效", status=1, claim_status=1, expect_ok=False, expect_reason="仍未显示为已领取"),
+    Scenario("状态无法识别", status=5, expect_ok=False, expect_reason="无法识别"),
+]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    scenario = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, data=None, message="", cookie=None):
+        body = json.dumps({"code": code, "message": message, "data": data}, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def payload(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def authorized(self):
+        if self.headers.get("X-CSRF-Token") == CSRF_TOKEN:
+            return True
+        self.reply(40100, message="未登录")
+        return False
+
+    def tasks(self):
+        return [
+            {"Name": "绑定微信", "Status": 0},
+            {"Name": "每日签到", "Status": self.scenario.status},
+        ]
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == "/user/reward/tasks":
+            self.reply(200, self.tasks())
+        elif self.path == "/user/":
+            self.reply(200, {"Points": 12345})
+        else:
+            self.reply(404, message="not found")
+
+    def do_POST(self):
+        scenario = self.scenario
+        data = self.payload()
+        if self.path == "/user/login":
+            if scenario.login_message:
+                self.reply(40000, message=scenario.login_message)
+            elif data.get("password") != PASSWORD:
+                self.reply(40000, message="密码错误")
+            else:
+                self.reply(200, {}, cookie=f"X-CSRF-Token={CSRF_TOKEN}; Path=/")
+        elif self.path == "/user/reward/tasks":
+            if not self.authorized():
+                return
+            scenario.claims += 1
+            scenario.status = scenario.claim_status
+            self.reply(200, None)
+        else:
+            self.reply(404, message="not found")
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandinHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # rainyun.py 在导入时读取这些配置，必须先设置好再导入
+    os.environ["RAINYUN_API_BASE"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["RAINYUN_ENGINE"] = "http"
+    sys.path.insert(0, ROOT)
+    import rainyun
+
+    print("=" * 50)
+    print(f"        雨云接口替身服务 {rainyun.RAINYUN_API_BASE}")
+    print("=" * 50)
+    failed = 0
+    for scenario in SCENARIOS:
+        StandinHandler.scenario = scenario
+        ok, _, points, reason = rainyun._sign_in("standin@example.com", scenario.password, False, True, None,
+                                                 rainyun.SpanTrace())
+        passed = ok == scenario.expect_ok and (ok or scenario.expect_reason in (reason or ""))
+        if scenario.name == "已领取":
+            passed = passed and scenario.claims == 0
+        failed += not passed
+        detail = f"积分 {points}" if ok else f"原因: {reason}"
+        print(f"{'✅' if passed else '❌'} {scenario.name}: {'成功' if ok else '失败'}，{detail}")
+    server.shutdown()
+    print("-" * 50)
+    print(f"共 {len(SCENARIOS)} 个场景，失败 {failed} 个")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -124,10 +124,21 @@ push_config = {
 }
 # fmt: on
 
-for k in push_config:
-    if os.getenv(k):
-        v = os.getenv(k)
-        push_config[k] = v
+_push_config_loaded = False
+
+
+def load_push_config() -> None:
+    """
+    从环境变量读取推送配置。推迟到第一次发送时执行，导入本模块不再遍历环境变量。
+    """
+    global _push_config_loaded
+    if _push_config_loaded:
+        return
+    _push_config_loaded = True
+    for k in push_config:
+        if os.getenv(k):
+            v = os.getenv(k)
+            push_config[k] = v
 
 
 def bark(title: str, content: str) -> None:
@@ -989,6 +1000,7 @@ def add_notify_function():
 
 
 def send(title: str, content: str, ignore_default_config: bool = False, **kwargs):
+    load_push_config()
     if kwargs:
         global push_config
         if ignore_default_config:
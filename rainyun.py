@@ -1,102 +1,1096 @@
+import base64
+import fnmatch
+import hashlib
+import hmac
+import importlib
+import itertools
+import json
 import logging
 import os
+import queue
 import random
+import sqlite3
 import re
+import shutil
 import time
 import subprocess
 import sys
-
-import cv2
-import ddddocr
-import requests
-from selenium import webdriver
-from selenium.common import TimeoutException
-from selenium.webdriver import ActionChains
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.webdriver import WebDriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 try:
     from dotenv import load_dotenv
     load_dotenv()
 except Exception:
     pass
-# --- 修复1：正确的 webdriver_manager 导入 ---
-try:
-    from webdriver_manager.chrome import ChromeDriverManager
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    延迟导入的模块代理：第一次访问属性时才真正 import。
+    cv2 / ddddocr(onnxruntime) / numpy / requests 的导入都要上百毫秒，
+    账户配置错误直接退出、或者全程没有出现验证码时，这些开销完全可以省掉。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+cv2 = LazyModule("cv2")
+ddddocr = LazyModule("ddddocr")
+np = LazyModule("numpy")
+requests = LazyModule("requests")
+Image = LazyModule("PIL.Image")
+
+
+# --- 修复1：正确的 webdriver_manager 导入（改为首次初始化浏览器时才导入） ---
+def load_webdriver_manager():
     try:
-        from webdriver_manager.core.utils import ChromeType
-    except ImportError:
+        from webdriver_manager.chrome import ChromeDriverManager
         try:
-            from webdriver_manager.chrome import ChromeType
+            from webdriver_manager.core.utils import ChromeType
         except ImportError:
-            ChromeType = None
-except ImportError:
-    print("webdriver_manager未安装，将使用备用方式")
-    ChromeDriverManager = None
-    ChromeType = None
+            try:
+                from webdriver_manager.chrome import ChromeType
+            except ImportError:
+                ChromeType = None
+    except ImportError:
+        print("webdriver_manager未安装，将使用备用方式")
+        ChromeDriverManager = None
+        ChromeType = None
+    return ChromeDriverManager, ChromeType
 
-# --- 修复2：确保 notify 正常导入 ---
-try:
-    from notify import send
-    print("已加载通知模块 (notify.py)")
-except ImportError:
-    print("警告: 未找到 notify.py，将无法发送通知。")
-    def send(*args, **kwargs):
-        pass
+
+# --- 修复2：确保 notify 正常导入（改为发送通知时才导入） ---
+def load_notify():
+    try:
+        from notify import send
+        print("已加载通知模块 (notify.py)")
+        return send
+    except ImportError:
+        print("警告: 未找到 notify.py，将无法发送通知。")
+        def send(*args, **kwargs):
+            pass
+        return send
+
+# 最优分配与次优分配的总分差不超过该值时视为无法区分，直接刷新验证码
+CAPTCHA_MIN_MARGIN = float(os.environ.get("CAPTCHA_MIN_MARGIN", "0"))
+# 任一图标的匹配率低于该值时直接刷新验证码
+CAPTCHA_MIN_SCORE = float(os.environ.get("CAPTCHA_MIN_SCORE", "0"))
+# 相似度计算后端：sift / orb / template / shape / cascade
+CAPTCHA_MATCHER = os.environ.get("CAPTCHA_MATCHER", "sift")
+# cascade 模式下在 SIFT 之前依次尝试的便宜后端，以及直接采用其结果所需的分差和最低匹配率
+CAPTCHA_CASCADE = [name.strip() for name in os.environ.get("CAPTCHA_CASCADE", "template,orb").split(",") if name.strip()]
+CAPTCHA_CASCADE_MARGIN = float(os.environ.get("CAPTCHA_CASCADE_MARGIN", "0.15"))
+CAPTCHA_CASCADE_MIN_SCORE = float(os.environ.get("CAPTCHA_CASCADE_MIN_SCORE", "0.3"))
+# 预处理方式：crop 为每个候选框/图标各自缩放后再滤波；full 为整张背景图和图标条各滤波一次，候选框直接取切片视图
+# 两种方式得到的特征不同，切换后应换一个 CAPTCHA_ICON_CACHE 文件
+CAPTCHA_PREPROCESS = os.environ.get("CAPTCHA_PREPROCESS", "crop").lower()
+# 图标感知哈希缓存（SQLite 文件路径，留空不启用）、最大条目数和判定为同一图标的最大汉明距离
+CAPTCHA_ICON_CACHE = os.environ.get("CAPTCHA_ICON_CACHE", "")
+CAPTCHA_ICON_CACHE_MAX = int(os.environ.get("CAPTCHA_ICON_CACHE_MAX", "5000"))
+CAPTCHA_ICON_HASH_DISTANCE = int(os.environ.get("CAPTCHA_ICON_HASH_DISTANCE", "8"))
+# 相似度打分线程数（1 为串行），以及启用线程池的最少任务数
+CAPTCHA_WORKERS = int(os.environ.get("CAPTCHA_WORKERS", "1"))
+CAPTCHA_PARALLEL_MIN_ITEMS = int(os.environ.get("CAPTCHA_PARALLEL_MIN_ITEMS", "6"))
+# 图标显著轮廓数达到该值即认为不可能是 "0"/"1"，跳过 OCR；0 表示关闭，建议先用采集的数据集验证后再开启
+CAPTCHA_GATE_MIN_CONTOURS = int(os.environ.get("CAPTCHA_GATE_MIN_CONTOURS", "0"))
+# 单次验证码处理的最大轮数与总时间预算（秒）
+CAPTCHA_MAX_ATTEMPTS = int(os.environ.get("CAPTCHA_MAX_ATTEMPTS", "8"))
+CAPTCHA_TIME_BUDGET = float(os.environ.get("CAPTCHA_TIME_BUDGET", "120"))
+# 刷新验证码前的等待时间（秒），提交被拒后逐轮翻倍直到上限
+CAPTCHA_BACKOFF_MIN = float(os.environ.get("CAPTCHA_BACKOFF_MIN", "2"))
+CAPTCHA_BACKOFF_MAX = float(os.environ.get("CAPTCHA_BACKOFF_MAX", "16"))
+
+
+class ModelPool:
+    """
+    进程级 ddddocr 模型池。
+    模型在第一次真正需要时才加载（即第一次出现验证码），之后的账户直接复用；
+    每个实例同一时间只借给一个调用方，实例数量上限由 size 控制。
+    """
+
+    def __init__(self, name, factory, size=1):
+        self.name = name
+        self._factory = factory
+        self._size = max(1, size)
+        self._created = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        try:
+            model = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self._size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    logger.info(f"加载 ddddocr 模型: {self.name}")
+                    model = self._factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                model = self._idle.get()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+
+DDDDOCR_POOL_SIZE = int(os.environ.get("DDDDOCR_POOL_SIZE", "1"))
+OCR_MODELS = ModelPool("ocr", lambda: ddddocr.DdddOcr(ocr=True, show_ad=False), DDDDOCR_POOL_SIZE)
+DET_MODELS = ModelPool("det", lambda: ddddocr.DdddOcr(det=True, show_ad=False), DDDDOCR_POOL_SIZE)
+
+
+# ChromeDriver 解析：显式指定的驱动路径、解析结果缓存文件，以及离线模式（不做任何联网的版本检查）
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH", "")
+CHROMEDRIVER_CACHE = os.environ.get("CHROMEDRIVER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "rainyun", "chromedriver.json"))
+CHROMEDRIVER_OFFLINE = os.environ.get("CHROMEDRIVER_OFFLINE", "false").lower() == "true"
+CHROME_BINARIES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser"]
+# macOS 的 Chrome 一般不在 PATH 里，按默认安装位置查找
+CHROME_MAC_PATHS = [
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+    "/Applications/Chromium.app/Contents/MacOS/Chromium",
+]
+# Windows 上 chrome.exe --version 不输出版本号（会直接打开浏览器），改从注册表读取
+CHROME_WINDOWS_KEYS = [r"Software\Google\Chrome\BLBeacon", r"Software\Chromium\BLBeacon"]
+
+_driver_lock = threading.Lock()
+_driver_resolved = False
+_driver_path = None
+
+
+def binary_version(path) -> Optional[str]:
+    """执行 `<path> --version`，返回形如 131.0.6778.85 的版本号"""
+    try:
+        output = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"(\d+)\.\d+\.\d+(?:\.\d+)?", output)
+    return match.group(0) if match else None
+
+
+def windows_chrome_version() -> Optional[str]:
+    try:
+        import winreg
+    except ImportError:
+        return None
+    for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+        for key in CHROME_WINDOWS_KEYS:
+            try:
+                with winreg.OpenKey(root, key) as handle:
+                    version = winreg.QueryValueEx(handle, "version")[0]
+            except OSError:
+                continue
+            if version:
+                return str(version)
+    return None
+
+
+def chrome_version() -> Optional[str]:
+    if sys.platform == "win32":
+        return windows_chrome_version()
+    paths = [shutil.which(name) for name in CHROME_BINARIES]
+    if sys.platform == "darwin":
+        paths += [path for path in CHROME_MAC_PATHS if os.path.isfile(path)]
+    for path in paths:
+        if path:
+            version = binary_version(path)
+            if version:
+                return version
+    return None
+
+
+def same_major(a, b) -> bool:
+    return bool(a and b) and a.split(".")[0] == b.split(".")[0]
+
+
+def load_driver_cache() -> dict:
+    try:
+        with open(CHROMEDRIVER_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_driver_cache(chrome, driver_path, driver):
+    try:
+        os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE), exist_ok=True)
+        with open(CHROMEDRIVER_CACHE, "w", encoding="utf-8") as f:
+            json.dump({"chrome": chrome, "driver_path": driver_path, "driver": driver, "resolved_at": time.time()}, f)
+    except OSError as e:
+        logger.warning(f"写入 ChromeDriver 缓存失败: {e}")
+
+
+def resolve_chromedriver() -> Optional[str]:
+    """
+    返回与本机 Chrome 主版本一致的 ChromeDriver 路径，整个进程只解析一次。依次尝试：
+      1. CHROMEDRIVER_PATH（绝对路径或 PATH 中的命令名）
+      2. 缓存文件里上次解析出的驱动（文件仍在且主版本与当前 Chrome 一致；取不到 Chrome 版本时直接使用）
+      3. PATH 中的 chromedriver
+      4. webdriver-manager 下载（离线模式跳过）
+    版本兼容性只通过 `--version` 在本地检查，不联网。都不可用时返回 None，由 Selenium 自行查找驱动。
+    """
+    global _driver_resolved, _driver_path
+    with _driver_lock:
+        if _driver_resolved:
+            return _driver_path
+        start = time.perf_counter()
+        chrome = chrome_version()
+        path, source = None, "selenium"
+
+        candidates = []
+        if CHROMEDRIVER_PATH:
+            candidates.append((shutil.which(CHROMEDRIVER_PATH) or CHROMEDRIVER_PATH, "CHROMEDRIVER_PATH"))
+        cached = load_driver_cache()
+        # 取不到 Chrome 版本时与 PATH 中的驱动一样直接信任缓存，免得每次都联网下载
+        if cached.get("driver_path") and (chrome is None or same_major(cached.get("chrome"), chrome)):
+            candidates.append((cached["driver_path"], "缓存"))
+        if shutil.which("chromedriver"):
+            candidates.append((shutil.which("chromedriver"), "PATH"))
+        for candidate, label in candidates:
+            if not os.path.isfile(candidate):
+                continue
+            version = binary_version(candidate)
+            # 取不到 Chrome 版本时无法比较，直接信任候选驱动
+            if version and (chrome is None or same_major(version, chrome)):
+                path, source = candidate, label
+                break
+            logger.warning(f"{label} 的 ChromeDriver {version} 与 Chrome {chrome} 主版本不一致，跳过")
+
+        if path is None and not CHROMEDRIVER_OFFLINE:
+            ChromeDriverManager, ChromeType = load_webdriver_manager()
+            if ChromeDriverManager:
+                try:
+                    if ChromeType and hasattr(ChromeType, 'GOOGLE'):
+                        manager = ChromeDriverManager(chrome_type=ChromeType.GOOGLE)
+                    else:
+                        manager = ChromeDriverManager()
+                    path, source = manager.install(), "webdriver-manager"
+                except Exception as e:
+                    print(f"webdriver-manager失败: {e}")
+        if path is None and CHROMEDRIVER_OFFLINE:
+            # 让 Selenium Manager 也只使用本地已有的驱动
+            os.environ.setdefault("SE_OFFLINE", "true")
+
+        if path:
+            driver = binary_version(path)
+            # 这次没取到 Chrome 版本时保留缓存里记录的版本
+            recorded = chrome or (cached.get("chrome") if cached.get("driver_path") == path else None)
+            if cached.get("driver_path") != path or cached.get("chrome") != recorded or cached.get("driver") != driver:
+                save_driver_cache(recorded, path, driver)
+        _driver_resolved, _driver_path = True, path
+        logger.info(f"ChromeDriver 解析耗时 {time.perf_counter() - start:.2f}s，来源: {source}，"
+                    f"Chrome {chrome or '未知'}{'，离线模式' if CHROMEDRIVER_OFFLINE else ''}")
+        return path
+
+
+# 网络拦截档位：off 不拦截；lite 拦截统计分析脚本、字体和音视频；strict 在 lite 基础上再拦截站点图片
+BROWSER_BLOCK_PROFILE = os.environ.get("BROWSER_BLOCK_PROFILE", "off").lower()
+# 额外拦截的 URL 模式（Chrome 通配符，逗号分隔）
+BROWSER_BLOCK_URLS = [u.strip() for u in os.environ.get("BROWSER_BLOCK_URLS", "").split(",") if u.strip()]
+# 验证码相关域名永远放行，会命中这些域名的拦截模式一律丢弃
+CAPTCHA_ORIGINS = [
+    "https://turing.captcha.qcloud.com",
+    "https://turing.captcha.gtimg.com",
+    "https://captcha.gtimg.com",
+    "https://ssl.captcha.qq.com",
+]
+# 按扩展名拦截的资源只限定在雨云自己的域名下，验证码 iframe 的资源不受影响
+BLOCK_HOSTS = ["*://*.rainyun.com/"]
+RESOURCE_TYPES = {
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp4", "webm", "mp3", "ogg", "m4a"),
+}
+ANALYTICS_PATTERNS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*hm.baidu.com*",
+    "*cnzz.com*",
+    "*clarity.ms*",
+    "*sentry.io*",
+]
+# 验证码图片来源：download 用 requests 重新下载；network 直接读取浏览器已经收到的响应体，读不到时再下载
+CAPTCHA_IMAGE_SOURCE = os.environ.get("CAPTCHA_IMAGE_SOURCE", "download").lower()
+# 被拦截的请求拿不到响应大小，按类型估算节省的流量（字节）
+BLOCKED_SIZE_ESTIMATE = {"image": 30_000, "font": 60_000, "media": 500_000, "script": 40_000, "other": 10_000}
+
+
+def resource_type(url) -> str:
+    path = url.split("?", 1)[0].split("#", 1)[0].lower()
+    name = path.rsplit("/", 1)[-1]
+    ext = name.rsplit(".", 1)[-1] if "." in name else ""
+    for kind, extensions in RESOURCE_TYPES.items():
+        if ext in extensions:
+            return kind
+    return "script" if ext == "js" else "other"
+
+
+def block_patterns(profile=None) -> List[str]:
+    """按拦截档位生成 Network.setBlockedURLs 的模式列表"""
+    profile = BROWSER_BLOCK_PROFILE if profile is None else profile
+    patterns = []
+    if profile in ("lite", "strict"):
+        kinds = ["font", "media"] + (["image"] if profile == "strict" else [])
+        patterns += ANALYTICS_PATTERNS
+        patterns += [f"{host}*.{ext}*" for host in BLOCK_HOSTS for kind in kinds for ext in RESOURCE_TYPES[kind]]
+    patterns += BROWSER_BLOCK_URLS
+    # 用验证码域名下各类资源的示例地址逐条检查
+    probes = [f"{origin}/{name}.{ext}?t=1" for origin in CAPTCHA_ORIGINS
+              for name, exts in RESOURCE_TYPES.items() for ext in exts]
+    probes += [origin + "/cap_union_new_getcapbysig?img_index=1" for origin in CAPTCHA_ORIGINS]
+    safe = []
+    for pattern in patterns:
+        if any(fnmatch.fnmatchcase(probe, pattern) for probe in probes):
+            logger.warning(f"拦截模式 {pattern} 会命中验证码域名，已忽略")
+        else:
+            safe.append(pattern)
+    return safe
+
+
+def url_origin(url) -> Optional[str]:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc.rsplit('@', 1)[-1].lower()}"
+
+
+def read_performance_log(driver) -> list:
+    """
+    读取 performance 日志里的 CDP 消息，同时把请求过的站点记到 driver.visited_origins，浏览器池归还实例时按它清空存储。
+    get_log 每次只返回上次读取之后的新事件，NetworkMonitor 和浏览器池都经由这里读取，站点不会漏记。
+    """
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return []
+    origins = getattr(driver, "visited_origins", None)
+    messages = []
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        if origins is not None and message.get("method") == "Network.requestWillBeSent":
+            origin = url_origin(message.get("params", {}).get("request", {}).get("url", ""))
+            if origin:
+                origins.add(origin)
+        messages.append(message)
+    return messages
+
+
+class NetworkMonitor:
+    """
+    从 Chrome 的 performance 日志（CDP Network 事件）统计单个账户的网络开销：
+    请求数、实际传输字节数、被拦截的请求数及估算节省的字节数。
+    get_log 每次只返回上次读取之后的新事件，开始处理账户时先清空一次，避免把上个账户的事件算进来。
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.requests = 0
+        self.transferred = 0
+        self.blocked = {}
+        self._urls = {}
+        self._images = {}      # 图片 URL -> 最近一次的 requestId
+        self._finished = set()
+        self.poll(count=False)
+
+    def poll(self, count=True):
+        messages = read_performance_log(self.driver)
+        if not count:
+            return
+        for message in messages:
+            self.handle(message.get("method"), message.get("params", {}))
+
+    def handle(self, method, params):
+        if method == "Network.requestWillBeSent":
+            self.requests += 1
+            self._urls[params.get("requestId")] = params.get("request", {}).get("url", "")
+        elif method == "Network.responseReceived":
+            response = params.get("response", {})
+            if str(response.get("mimeType", "")).startswith("image/"):
+                self._images[response.get("url", "")] = params.get("requestId")
+        elif method == "Network.loadingFinished":
+            self.transferred += int(params.get("encodedDataLength", 0) or 0)
+            self._finished.add(params.get("requestId"))
+        elif method == "Network.loadingFailed" and params.get("blockedReason") == "inspector":
+            kind = resource_type(self._urls.get(params.get("requestId"), ""))
+            self.blocked[kind] = self.blocked.get(kind, 0) + 1
+
+    def image_body(self, url) -> Optional[bytes]:
+        """取浏览器已经加载完成的图片响应体；style 里的地址可能是相对地址或省略了协议，按后缀匹配"""
+        self.poll()
+        key = url.split("://", 1)[-1].lstrip("/")
+        request_id = self._images.get(url)
+        if request_id is None:
+            for seen, rid in self._images.items():
+                if key and seen.split("://", 1)[-1].endswith(key):
+                    request_id = rid
+        if request_id is None or request_id not in self._finished:
+            return None
+        try:
+            body = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception as e:
+            logger.debug(f"读取响应体失败: {e}")
+            return None
+        if body.get("base64Encoded"):
+            return base64.b64decode(body.get("body", ""))
+        return body.get("body", "").encode("latin-1")
+
+    @property
+    def saved_estimate(self) -> int:
+        return sum(BLOCKED_SIZE_ESTIMATE[kind] * count for kind, count in self.blocked.items())
+
+    def report(self) -> str:
+        # 只格式化已有的计数：调用时浏览器可能已经归还给池，再读日志会吃掉其他账户的事件
+        text = f"请求 {self.requests} 个，实际传输 {self.transferred / 1024:.0f} KB"
+        if self.blocked:
+            detail = ", ".join(f"{kind} {count}" for kind, count in sorted(self.blocked.items()))
+            text += f"，拦截 {sum(self.blocked.values())} 个（{detail}），估算节省 {self.saved_estimate / 1024:.0f} KB"
+        return text
+
+
+def network_logging_enabled() -> bool:
+    return BROWSER_BLOCK_PROFILE in ("lite", "strict") or bool(BROWSER_BLOCK_URLS) or CAPTCHA_IMAGE_SOURCE == "network"
+
+
+def apply_block_profile(driver):
+    if not network_logging_enabled():
+        return
+    patterns = block_patterns()
+    try:
+        # getResponseBody 和 setBlockedURLs 都需要先启用 Network 域
+        driver.execute_cdp_cmd("Network.enable", {})
+        if patterns:
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+            logger.info(f"已启用网络拦截（{BROWSER_BLOCK_PROFILE}），共 {len(patterns)} 条规则")
+    except Exception as e:
+        logger.warning(f"启用网络拦截失败: {e}")
+
+
+# 浏览器档位：default 保持原来的参数；lowmem 缩小窗口、限制渲染进程数、关闭后台服务和扩展，用户目录放在 /dev/shm
+BROWSER_PROFILE = os.environ.get("BROWSER_PROFILE", "default").lower()
+LOWMEM_ARGUMENTS = [
+    '--renderer-process-limit=2',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-breakpad',
+    '--no-first-run',
+    '--mute-audio',
+    '--disable-dev-shm-usage',
+]
+LOWMEM_DISABLED_FEATURES = ["Translate", "MediaRouter", "OptimizationHints", "BackForwardCache"]
+
+
+def make_profile_dir() -> str:
+    # 优先放在内存文件系统里，省掉磁盘 IO；没有 /dev/shm 时退回系统临时目录
+    root = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+    return tempfile.mkdtemp(prefix="rainyun-chrome-", dir=root)
 
 
 def init_selenium(debug=False, headless=False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
     ops = webdriver.ChromeOptions()
     if headless or os.environ.get("GITHUB_ACTIONS", "false") == "true":
         for option in ['--headless', '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu']:
             ops.add_argument(option)
-    ops.add_argument('--window-size=1920,1080')
+    lowmem = BROWSER_PROFILE == "lowmem"
+    ops.add_argument('--window-size=1280,800' if lowmem else '--window-size=1920,1080')
     ops.add_argument('--disable-blink-features=AutomationControlled')
     ops.add_argument('--no-proxy-server')
     ops.add_argument('--lang=zh-CN')
+    # 通过 performance 日志读取 CDP Network 事件：统计流量，并记下账户请求过的站点供浏览器池清理存储
+    ops.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    ops.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+    # --disable-features 只认最后一个，需要合并成一条
+    disabled_features = []
+    if CAPTCHA_IMAGE_SOURCE == "network":
+        # 跨域的验证码 iframe 默认跑在独立进程里，它的网络事件和响应体不走页面的 DevTools 会话
+        disabled_features += ["IsolateOrigins", "site-per-process"]
+    profile_dir = None
+    if lowmem:
+        for option in LOWMEM_ARGUMENTS:
+            ops.add_argument(option)
+        disabled_features += LOWMEM_DISABLED_FEATURES
+        profile_dir = make_profile_dir()
+        ops.add_argument(f'--user-data-dir={profile_dir}')
+    if disabled_features:
+        ops.add_argument('--disable-features=' + ','.join(disabled_features))
     
     is_github_actions = os.environ.get("GITHUB_ACTIONS", "false") == "true"
     if debug and not is_github_actions:
         ops.add_experimental_option("detach", True)
     
+    driver_path = resolve_chromedriver()
     try:
-        if ChromeDriverManager:
-            if ChromeType and hasattr(ChromeType, 'GOOGLE'):
-                manager = ChromeDriverManager(chrome_type=ChromeType.GOOGLE)
-            else:
-                manager = ChromeDriverManager()
-            driver_path = manager.install()
+        if driver_path:
             service = Service(driver_path)
             driver = webdriver.Chrome(service=service, options=ops)
+            driver.profile_dir = profile_dir
+            driver.visited_origins = set()
             return driver
     except Exception as e:
-        print(f"webdriver-manager失败: {e}")
+        print(f"使用 ChromeDriver {driver_path} 启动失败: {e}")
 
     # 备用方案
     try:
         driver = webdriver.Chrome(options=ops)
+        driver.profile_dir = profile_dir
+        driver.visited_origins = set()
         return driver
     except Exception:
         pass
+    if profile_dir:
+        shutil.rmtree(profile_dir, ignore_errors=True)
         
     raise Exception("无法初始化Selenium WebDriver")
 
-def download_image(url, filename):
-    os.makedirs("temp", exist_ok=True)
+
+# 单账户资源采样：采样间隔（秒），0 表示不采样；仅在有 /proc 的 Linux 上生效
+RESOURCE_SAMPLE_INTERVAL = float(os.environ.get("RESOURCE_SAMPLE_INTERVAL", "1"))
+
+
+def process_table() -> Dict[int, Tuple[int, float, int]]:
+    """读取 /proc，返回 {pid: (ppid, 累计 CPU 秒数, RSS 字节)}"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    page = os.sysconf("SC_PAGE_SIZE")
+    table = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能带空格和括号，从最后一个 ")" 之后开始按空格切分
+        fields = stat[stat.rfind(")") + 2:].split()
+        try:
+            table[int(name)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks, int(fields[21]) * page)
+        except (IndexError, ValueError):
+            continue
+    return table
+
+
+class ResourceSampler:
+    """
+    在后台线程里定期采样 chromedriver 及其全部子进程（Chrome 浏览器、渲染进程等）的 RSS 和 CPU。
+    浏览器池里的实例会跨账户复用，CPU 按账户开始时各进程的累计值做差；中途退出的进程按最后一次采样计入。
+    """
+
+    def __init__(self, root_pid, interval=None):
+        self.root_pid = root_pid
+        self.interval = RESOURCE_SAMPLE_INTERVAL if interval is None else interval
+        self.samples = 0
+        self.peak_rss = 0
+        self.total_rss = 0
+        self.peak_processes = 0
+        self._baseline = {}
+        self._last_cpu = {}
+        self._start = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def available() -> bool:
+        return os.path.isdir("/proc") and RESOURCE_SAMPLE_INTERVAL > 0
+
+    def _tree(self, table):
+        children = {}
+        for pid, (ppid, _, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+        pids, stack = [], [self.root_pid]
+        while stack:
+            pid = stack.pop()
+            if pid in table:
+                pids.append(pid)
+                stack.extend(children.get(pid, []))
+        return pids
+
+    def sample(self):
+        table = process_table()
+        pids = self._tree(table)
+        rss = sum(table[pid][2] for pid in pids)
+        for pid in pids:
+            self._last_cpu[pid] = table[pid][1]
+        self.samples += 1
+        self.total_rss += rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_processes = max(self.peak_processes, len(pids))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                pass
+
+    def start(self):
+        self._start = time.monotonic()
+        table = process_table()
+        self._baseline = {pid: table[pid][1] for pid in self._tree(table)}
+        self._last_cpu = dict(self._baseline)
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.sample()
+        except Exception:
+            pass
+        self.elapsed = time.monotonic() - self._start
+        return self.summary()
+
+    def summary(self) -> dict:
+        cpu = sum(value - self._baseline.get(pid, 0.0) for pid, value in self._last_cpu.items())
+        return {
+            "peak_rss_mb": self.peak_rss / 1024 / 1024,
+            "mean_rss_mb": self.total_rss / max(1, self.samples) / 1024 / 1024,
+            "cpu_s": cpu,
+            "elapsed_s": self.elapsed,
+            "processes": self.peak_processes,
+        }
+
+
+def format_resources(stats) -> str:
+    return (f"峰值 RSS {stats['peak_rss_mb']:.0f} MB，平均 {stats['mean_rss_mb']:.0f} MB，"
+            f"CPU {stats['cpu_s']:.1f}s / 墙钟 {stats['elapsed_s']:.1f}s，进程 {stats['processes']} 个")
+
+
+def start_resource_sampler(driver) -> Optional[ResourceSampler]:
+    if not ResourceSampler.available():
+        return None
     try:
-        response = requests.get(url, timeout=10, proxies={"http": None, "https": None}, verify=False)
-        if response.status_code == 200:
-            with open(os.path.join("temp", filename), "wb") as f:
-                f.write(response.content)
-            return True
-        return False
+        return ResourceSampler(driver.service.process.pid).start()
     except Exception as e:
-        logger.error(f"下载图片异常: {str(e)}")
-        return False
+        logger.debug(f"无法采样浏览器资源: {e}")
+        return None
+
+
+# 每个账户的资源采样结果，运行结束时汇总输出
+ACCOUNT_RESOURCES = {}
+_account_resources_lock = threading.Lock()
+
+
+# 浏览器池：同时保持的 Chrome 实例数，以及单个实例最多服务的账户数（到达后关闭重开，防止内存泄漏）
+BROWSER_POOL_SIZE = int(os.environ.get("BROWSER_POOL_SIZE", "1"))
+BROWSER_MAX_USES = int(os.environ.get("BROWSER_MAX_USES", "10"))
+# 归还实例时无论是否请求过都要清空存储的站点；账户实际请求过的站点从 performance 日志收集，一并清空
+# （Cookie 通过 CDP 全部清除）
+BROWSER_CLEAR_ORIGINS = [
+    "https://app.rainyun.com",
+    "https://api.v2.rainyun.com",
+    "https://turing.captcha.qcloud.com",
+]
+
+
+class BrowserPool:
+    """
+    Chrome 实例池，避免每个账户都重新解析 ChromeDriver、冷启动 Chrome、注入 stealth.min.js。
+    借出前检查实例是否还活着；归还时回到 about:blank，关闭多余窗口，清空全部 Cookie，
+    并清空该账户请求过的每个站点（含验证码和 CDN 域名）的存储，下一个账户拿到的是干净的会话。清理失败或使用次数达到 max_uses 的实例直接关闭，需要时再重新启动。
+    """
+
+    def __init__(self, size=1, max_uses=10, debug=False, headless=False):
+        self._size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.debug = debug
+        self.headless = headless
+        self.launched = 0
+        self._created = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _launch(self, trace):
+        logger.info("初始化 Selenium")
+        with trace.span("driver_init"):
+            driver = init_selenium(debug=self.debug, headless=self.headless)
+        with trace.span("stealth_inject"):
+            try:
+                with open("stealth.min.js", mode="r") as f: js = f.read()
+                driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": js})
+            except Exception:
+                pass
+            apply_block_profile(driver)
+        with self._lock:
+            self.launched += 1
+        return driver
+
+    def _take(self, trace):
+        # 返回 (driver, 已使用次数)；实例数已达上限时阻塞等待归还
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self._size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._launch(trace), 0
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, driver):
+        with self._lock:
+            self._created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        # lowmem 档位的临时用户目录
+        profile_dir = getattr(driver, "profile_dir", None)
+        if profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    @staticmethod
+    def _alive(driver) -> bool:
+        try:
+            return bool(driver.window_handles)
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        read_performance_log(driver)
+        visited = getattr(driver, "visited_origins", set())
+        for origin in sorted(set(BROWSER_CLEAR_ORIGINS) | set(CAPTCHA_ORIGINS) | visited):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        visited.clear()
+
+    @contextmanager
+    def acquire(self, trace=None):
+        # trace 用于记录启动浏览器（driver_init / stealth_inject）的耗时
+        trace = trace if trace is not None else SpanTrace()
+        with trace.span("driver_acquire"):
+            driver, uses = self._take(trace)
+            while not self._alive(driver):
+                logger.warning("浏览器实例已失效，重新启动")
+                self._discard(driver)
+                driver, uses = self._take(trace)
+        try:
+            yield driver
+        finally:
+            uses += 1
+            if uses >= self.max_uses:
+                if self.max_uses > 1:
+                    logger.info(f"浏览器实例已服务 {uses} 个账户，关闭后重新启动")
+                self._discard(driver)
+            else:
+                try:
+                    self._reset(driver)
+                    self._idle.put((driver, uses))
+                except Exception as e:
+                    logger.warning(f"清理浏览器会话失败，关闭该实例: {e}")
+                    self._discard(driver)
+
+    def close(self):
+        while True:
+            try:
+                driver, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+
+# 登录会话持久化：密钥（建议足够长的随机字符串）留空时不启用；会话文件目录
+RAINYUN_SESSION_KEY = os.environ.get("RAINYUN_SESSION_KEY", "")
+RAINYUN_SESSION_DIR = os.environ.get("RAINYUN_SESSION_DIR", ".sessions")
+RAINYUN_APP_ORIGIN = "https://app.rainyun.com"
+# CDP Network.setCookies 接受的字段
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires")
+# 会话文件格式：魔数 + 16 字节随机盐 + Fernet 密文；密钥由 RAINYUN_SESSION_KEY 和盐经 scrypt 派生
+SESSION_FILE_MAGIC = b"RYS2"
+SESSION_SALT_SIZE = 16
+SESSION_SCRYPT_N = 2 ** 15
+
+
+def load_fernet():
+    try:
+        from cryptography.fernet import Fernet
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+        return Fernet, Scrypt
+    except ImportError:
+        return None
+
+
+class SessionJar:
+    """
+    按账户加密保存登录后的 Cookie（CDP 取全部域名）和 app.rainyun.com 的 localStorage。
+    下次运行先恢复会话直接进入赚取积分页，会话失效时才走完整的登录和验证码流程。
+    文件名为用户名的 SHA-256，内容用 RAINYUN_SESSION_KEY 加随机盐经 scrypt 派生的 Fernet 密钥加密，盐存放在文件头；
+    未设置密钥或没有安装 cryptography 时不启用，绝不明文落盘。
+    """
+
+    def __init__(self, root, key=""):
+        self.root = root
+        self._key = key.encode("utf-8")
+        self._crypto = None
+        self._fernets = {}     # 盐 -> Fernet，scrypt 较慢，同一次运行里每个盐只派生一次
+        self._salt = None      # 本次运行保存会话使用的盐
+        self._lock = threading.Lock()
+        if not key:
+            return
+        self._crypto = load_fernet()
+        if self._crypto is None:
+            logger.warning("未安装 cryptography，无法加密保存登录会话，跳过会话持久化")
+
+    @property
+    def enabled(self) -> bool:
+        return self._crypto is not None
+
+    def _fernet(self, salt):
+        with self._lock:
+            if salt not in self._fernets:
+                Fernet, Scrypt = self._crypto
+                key = Scrypt(salt=salt, length=32, n=SESSION_SCRYPT_N, r=8, p=1).derive(self._key)
+                self._fernets[salt] = Fernet(base64.urlsafe_b64encode(key))
+            return self._fernets[salt]
+
+    def encrypt(self, data: bytes) -> bytes:
+        if self._salt is None:
+            self._salt = os.urandom(SESSION_SALT_SIZE)
+        return SESSION_FILE_MAGIC + self._salt + self._fernet(self._salt).encrypt(data)
+
+    def decrypt(self, blob: bytes) -> bytes:
+        if not blob.startswith(SESSION_FILE_MAGIC):
+            raise ValueError("会话文件格式不受支持")
+        salt = blob[len(SESSION_FILE_MAGIC):len(SESSION_FILE_MAGIC) + SESSION_SALT_SIZE]
+        return self._fernet(salt).decrypt(blob[len(SESSION_FILE_MAGIC) + SESSION_SALT_SIZE:])
+
+    def _path(self, user):
+        return os.path.join(self.root, hashlib.sha256(user.encode("utf-8")).hexdigest()[:32] + ".bin")
+
+    def load(self, user) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(user), "rb") as f:
+                state = json.loads(self.decrypt(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取登录会话失败（密钥变更或文件损坏），将重新登录: {str(e) or type(e).__name__}")
+            self.discard(user)
+            return None
+        return state if state.get("user") == user else None
+
+    def save(self, driver, user):
+        if not self.enabled:
+            return
+        try:
+            cookies = driver.execute_cdp_cmd("Network.getAllCookies", {}).get("cookies", [])
+            local_storage = {}
+            if driver.current_url.startswith(RAINYUN_APP_ORIGIN):
+                local_storage = driver.execute_script("return Object.assign({}, window.localStorage);") or {}
+            state = {
+                "user": user,
+                "saved": time.time(),
+                "cookies": [{k: c[k] for k in COOKIE_FIELDS if k in c} for c in cookies],
+                "local_storage": local_storage,
+            }
+            os.makedirs(self.root, exist_ok=True)
+            path = self._path(user)
+            with open(path + ".tmp", "wb") as f:
+                f.write(self.encrypt(json.dumps(state).encode("utf-8")))
+            os.replace(path + ".tmp", path)
+            logger.info(f"已保存登录会话（{len(state['cookies'])} 个 Cookie）")
+        except Exception as e:
+            logger.warning(f"保存登录会话失败: {e}")
+
+    def restore(self, driver, user) -> bool:
+        """把保存的会话写回浏览器，返回是否有可用的会话；是否仍然有效由调用方打开页面后判断"""
+        state = self.load(user)
+        if not state:
+            return False
+        now = time.time()
+        cookies = []
+        for cookie in state.get("cookies", []):
+            expires = cookie.get("expires", -1)
+            if expires is not None and 0 < expires < now:
+                continue
+            if expires is None or expires <= 0:
+                cookie = {k: v for k, v in cookie.items() if k != "expires"}
+            cookies.append(cookie)
+        if not cookies:
+            self.discard(user)
+            return False
+        try:
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+            local_storage = state.get("local_storage") or {}
+            if local_storage:
+                # localStorage 只能在同源页面里写入，先打开一个轻量的同源地址
+                driver.get(RAINYUN_APP_ORIGIN + "/favicon.ico")
+                driver.execute_script(
+                    "for (const [k, v] of Object.entries(arguments[0])) { window.localStorage.setItem(k, v); }",
+                    local_storage)
+        except Exception as e:
+            logger.warning(f"恢复登录会话失败: {e}")
+            return False
+        logger.info(f"已恢复 {time.strftime('%Y-%m-%d %H:%M', time.localtime(state.get('saved', 0)))} 保存的登录会话")
+        return True
+
+    def discard(self, user):
+        try:
+            os.remove(self._path(user))
+        except OSError:
+            pass
+
+
+SESSION_JAR = SessionJar(RAINYUN_SESSION_DIR, RAINYUN_SESSION_KEY)
+
+@dataclass
+class FetchResult:
+    """单张图片的下载结果"""
+    url: str
+    content: Optional[bytes] = None
+    status: Optional[int] = None
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.content) if self.content else 0
+
+
+class ImageFetcher:
+    """
+    验证码图片下载器。
+    所有下载共用一个 keep-alive 会话；背景图和图标并行拉取到内存，
+    每张图有独立的截止时间，连接错误、超时和 429/5xx 会在截止时间内重试。
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, deadline=10.0, retries=2, workers=2):
+        self.deadline = deadline
+        self.retries = retries
+        self._workers = workers
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(4, self._workers * 2))
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                # 与原来的 proxies={"http": None, "https": None}, verify=False 保持一致
+                session.trust_env = False
+                session.verify = False
+                self._session = session
+            return self._session
+
+    def fetch(self, url) -> FetchResult:
+        result = FetchResult(url=url)
+        start = time.monotonic()
+        deadline = start + self.deadline
+        while result.attempts <= self.retries:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result.error = result.error or "超过截止时间"
+                break
+            result.attempts += 1
+            try:
+                response = self.session.get(url, timeout=(min(3.0, remaining), remaining))
+                result.status = response.status_code
+                if response.status_code == 200:
+                    result.content = response.content
+                    result.error = None
+                    break
+                result.error = f"HTTP {response.status_code}"
+                if response.status_code not in self.RETRY_STATUS:
+                    break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                result.error = str(e)
+            except Exception as e:
+                result.error = str(e)
+                break
+            time.sleep(min(0.2 * result.attempts, max(0.0, deadline - time.monotonic())))
+        result.elapsed = time.monotonic() - start
+        return result
+
+    def fetch_all(self, urls) -> List[FetchResult]:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="captcha-fetch")
+        return list(self._executor.map(self.fetch, urls))
+
+
+# 每个账户一次拉背景图和图标两张；线程数和连接池按并发账户数放大，避免多个账户排队等同一个小线程池
+CAPTCHA_FETCHER = ImageFetcher(
+    deadline=float(os.environ.get("CAPTCHA_FETCH_DEADLINE", "10")),
+    retries=int(os.environ.get("CAPTCHA_FETCH_RETRIES", "2")),
+    workers=2 * max(1, int(os.environ.get("RAINYUN_CONCURRENCY", "1"))),
+)
+
+
+def decode_image(data, flags=None):
+    # 直接在内存中解码，避免写入 temp/ 再读回
+    if not data:
+        return None
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def split_sprite(raw):
+    # 按三等分切出提示图标，返回的是原图的切片视图，不做拷贝
+    w = raw.shape[1]
+    w_segment = w // 3
+    segments = []
+    for i in range(3):
+        start_x = max(0, w_segment * i + 2)
+        end_x = min(w, w_segment * (i + 1) - 2)
+        segments.append(raw[:, start_x:end_x])
+    return segments
 
 
 def get_url_from_style(style):
@@ -110,140 +1104,554 @@ def get_width_from_style(style):
 def get_height_from_style(style):
     return re.search(r'height:\s*([\d.]+)px', style).group(1)
 
-# --- 修复3：process_captcha 需要使用全局变量 ---
-def process_captcha():
-    # 声明使用全局变量，防止报错
-    global ocr, det, wait, driver
-    
+# 分阶段耗时导出目录，留空不导出；目录下写 spans.jsonl（每个账户一行）和 rainyun.prom（Prometheus textfile）
+RAINYUN_TRACE_DIR = os.environ.get("RAINYUN_TRACE_DIR", "")
+# 导出文件里用账户 ID 代替用户名（邮箱或手机号）；设置该值后 ID 改为 HMAC，无法通过枚举手机号反查
+RAINYUN_TRACE_SALT = os.environ.get("RAINYUN_TRACE_SALT", "")
+
+
+def account_id(user) -> str:
+    """用户名的 12 位十六进制摘要，同一账户每次运行都相同"""
+    data = user.encode("utf-8")
+    if RAINYUN_TRACE_SALT:
+        return hmac.new(RAINYUN_TRACE_SALT.encode("utf-8"), data, hashlib.sha256).hexdigest()[:12]
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+class SpanTrace:
+    """单个账户各阶段的耗时记录；span 内抛出的异常会记下异常类名后原样抛出"""
+
+    def __init__(self, account=""):
+        # 只保存账户 ID，spans.jsonl 和 Prometheus 指标里不会出现用户名
+        self.account = account_id(account) if account else ""
+        self.started = time.time()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.time()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.add(name, time.perf_counter() - t0, error, start=start, **attrs)
+
+    def add(self, name, duration, error=None, start=None, **attrs):
+        self.spans.append({
+            "name": name,
+            "start": round(start if start is not None else time.time() - duration, 3),
+            "duration": round(duration, 4),
+            "error": error,
+            **attrs,
+        })
+
+
+def prom_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class TraceExporter:
+    """
+    汇总所有账户的 SpanTrace：每个账户结束时向 spans.jsonl 追加一行，
+    整个运行结束时把各账户、各阶段的耗时、次数和失败次数写成 Prometheus textfile（先写临时文件再替换）。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.run_id = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self._accounts = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def export(self, trace, result):
+        if not self.enabled:
+            return
+        success, _, points, error = result
+        record = {
+            "run": self.run_id,
+            "account": trace.account,
+            "success": bool(success),
+            "error": error,
+            "points": points,
+            "started": round(trace.started, 3),
+            "duration": round(time.time() - trace.started, 3),
+            "spans": trace.spans,
+        }
+        try:
+            with self._lock:
+                self._accounts.append(record)
+                os.makedirs(self.root, exist_ok=True)
+                with open(os.path.join(self.root, "spans.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"写入 spans.jsonl 失败: {e}")
+
+    def write_prometheus(self):
+        if not self.enabled or not self._accounts:
+            return
+        lines = [
+            "# HELP rainyun_span_seconds 各阶段累计耗时（秒）",
+            "# TYPE rainyun_span_seconds gauge",
+        ]
+        counts, errors = [], []
+        for record in self._accounts:
+            account = prom_label(record["account"])
+            totals = {}
+            for span in record["spans"]:
+                seconds, count = totals.get(span["name"], (0.0, 0))
+                totals[span["name"]] = (seconds + span["duration"], count + 1)
+                if span["error"]:
+                    errors.append((account, span["name"], span["error"]))
+            for name, (seconds, count) in totals.items():
+                lines.append(f'rainyun_span_seconds{{account="{account}",span="{prom_label(name)}"}} {seconds:.4f}')
+                counts.append(f'rainyun_span_count{{account="{account}",span="{prom_label(name)}"}} {count}')
+        lines += ["# HELP rainyun_span_count 各阶段执行次数", "# TYPE rainyun_span_count gauge"] + counts
+        lines += ["# HELP rainyun_span_errors 各阶段失败次数，按异常类型区分", "# TYPE rainyun_span_errors gauge"]
+        for (account, name, error), count in sorted({k: errors.count(k) for k in errors}.items()):
+            lines.append(f'rainyun_span_errors{{account="{account}",span="{prom_label(name)}",error="{prom_label(error)}"}} {count}')
+        lines += ["# HELP rainyun_account_success 账户是否签到成功", "# TYPE rainyun_account_success gauge"]
+        lines += [f'rainyun_account_success{{account="{prom_label(r["account"])}"}} {int(r["success"])}' for r in self._accounts]
+        lines += ["# HELP rainyun_account_duration_seconds 账户处理总耗时（秒）", "# TYPE rainyun_account_duration_seconds gauge"]
+        lines += [f'rainyun_account_duration_seconds{{account="{prom_label(r["account"])}"}} {r["duration"]:.3f}' for r in self._accounts]
+        lines += ["# HELP rainyun_last_run_timestamp_seconds 本次运行结束时间", "# TYPE rainyun_last_run_timestamp_seconds gauge",
+                  f"rainyun_last_run_timestamp_seconds {time.time():.0f}"]
+        path = os.path.join(self.root, "rainyun.prom")
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"写入 Prometheus 指标失败: {e}")
+
+
+TRACE_EXPORTER = TraceExporter(RAINYUN_TRACE_DIR)
+
+
+@dataclass
+class AccountSession:
+    """单个账户的浏览器会话，在 sign_in_account、process_captcha 和 download_captcha_img 之间传递，取代原来的全局 driver / wait"""
+    user: str
+    driver: object
+    wait: object
+    waits: list = field(default_factory=list)   # [(名称, 实际耗时, 是否等到)]，见 wait_for
+    network: object = None                      # NetworkMonitor，启用网络拦截时才有
+    sampler: object = None                      # ResourceSampler，采样 chromedriver 和 Chrome 的资源占用
+    resources: Optional[dict] = None            # 浏览器归还前停止采样得到的统计
+    trace: SpanTrace = field(default_factory=SpanTrace)
+
+
+@contextmanager
+def account_session(user, driver, wait, trace):
+    """
+    在借出的浏览器上开始一个账户会话，需放在 pool.acquire 之内：
+    退出时先读完剩余的网络事件、停止资源采样，再把浏览器交还给池清理或关闭，统计不会量到已经重置的浏览器。
+    """
+    session = AccountSession(user, driver, wait, trace=trace)
+    if network_logging_enabled():
+        session.network = NetworkMonitor(driver)
+    session.sampler = start_resource_sampler(driver)
     try:
-        download_captcha_img()
-        if check_captcha():
-            logger.info("开始识别验证码")
-            captcha = cv2.imread("temp/captcha.jpg")
-            with open("temp/captcha.jpg", 'rb') as f:
-                captcha_b = f.read()
-            bboxes = det.detection(captcha_b)
-            result = dict()
-            for i in range(len(bboxes)):
-                x1, y1, x2, y2 = bboxes[i]
-                spec = captcha[y1:y2, x1:x2]
-                cv2.imwrite(f"temp/spec_{i + 1}.jpg", spec)
-                for j in range(3):
-                    similarity, matched = compute_similarity(f"temp/sprite_{j + 1}.jpg", f"temp/spec_{i + 1}.jpg")
-                    similarity_key = f"sprite_{j + 1}.similarity"
-                    position_key = f"sprite_{j + 1}.position"
-                    if similarity_key in result.keys():
-                        if float(result[similarity_key]) < similarity:
-                            result[similarity_key] = similarity
-                            result[position_key] = f"{int((x1 + x2) / 2)},{int((y1 + y2) / 2)}"
-                    else:
-                        result[similarity_key] = similarity
-                        result[position_key] = f"{int((x1 + x2) / 2)},{int((y1 + y2) / 2)}"
-            if check_answer(result):
-                for i in range(3):
-                    similarity_key = f"sprite_{i + 1}.similarity"
-                    position_key = f"sprite_{i + 1}.position"
-                    positon = result[position_key]
-                    logger.info(f"图案 {i + 1} 位于 ({positon})，匹配率：{result[similarity_key]}")
-                    slideBg = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="slideBg"]')))
-                    style = slideBg.get_attribute("style")
-                    x, y = int(positon.split(",")[0]), int(positon.split(",")[1])
+        yield session
+    finally:
+        if session.network is not None:
+            session.network.poll()
+        if session.sampler is not None:
+            session.resources = session.sampler.stop()
+
+
+def wait_for(session, name, condition, timeout):
+    """用条件等待代替固定 sleep：条件满足立即返回其结果，超时返回 None；每次等待的实际耗时记入 session.waits"""
+    from selenium.common import TimeoutException
+    from selenium.webdriver.support.wait import WebDriverWait
+
+    start = time.perf_counter()
+    try:
+        value = WebDriverWait(session.driver, timeout, poll_frequency=0.2).until(condition)
+    except TimeoutException:
+        value = None
+    session.waits.append((name, time.perf_counter() - start, value is not None))
+    return value
+
+
+def wait_report(waits) -> str:
+    # 按名称汇总：总耗时、次数和超时次数
+    summary = {}
+    for name, seconds, ok in waits:
+        total, count, timeouts = summary.get(name, (0.0, 0, 0))
+        summary[name] = (total + seconds, count + 1, timeouts + (not ok))
+    parts = []
+    for name, (total, count, timeouts) in summary.items():
+        part = f"{name} {total:.2f}s"
+        if count > 1:
+            part += f"/{count}次"
+        if timeouts:
+            part += f"（超时 {timeouts}）"
+        parts.append(part)
+    return ", ".join(parts)
+
+
+# 赚取积分页的状态探针：一次 execute_script 取回签到状态、领取按钮、积分和验证码 iframe，
+# 代替逐个 find_elements / is_displayed 的多次 WebDriver 往返
+EARN_POINTS_XPATH = '//*[@id="app"]/div[1]/div[3]/div[2]/div/div/div[2]/div[1]/div[1]/div/p/div/h3'
+EARN_LINK_STRATEGIES = [
+    ("xpath", '//*[@id="app"]/div[1]/div[3]/div[2]/div/div/div[2]/div[2]/div/div/div/div[1]/div/div[1]/div/div[1]/div/span[2]/a'),
+    ("xpath", '//a[contains(@href, "earn") and contains(text(), "赚取")]'),
+    ("css selector", 'a[href*="earn"]'),
+]
+EARN_PAGE_PROBE = """
+const xp = (path, ctx) => document.evaluate(path, ctx || document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+const visible = el => !!el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+const task = xp("//span[contains(text(),'每日签到')]");
+const claim = task && xp("following::a[contains(@href,'/account/reward/earn')][1]", task);
+const done = task && xp("following::span[contains(text(),'已完成')][1]", task);
+const points = xp(arguments[0]);
+const digits = points ? (points.textContent.match(/\\d+/g) || []).join('') : '';
+const links = arguments[1].map(([by, selector]) => by === 'xpath' ? xp(selector) : document.querySelector(selector));
+return {
+    ready: document.readyState,
+    task: !!task,
+    claimable: visible(claim),
+    completed: visible(done),
+    points: digits ? parseInt(digits, 10) : null,
+    captcha: visible(document.getElementById('tcaptcha_iframe_dy')),
+    earn_link: links.findIndex(visible),
+};
+"""
+
+
+def probe_earn_page(driver) -> dict:
+    """返回赚取积分页当前状态，字段见 EARN_PAGE_PROBE；earn_link 为第一个可见的“赚取积分”入口在 EARN_LINK_STRATEGIES 中的下标，没有为 -1"""
+    return driver.execute_script(EARN_PAGE_PROBE, EARN_POINTS_XPATH, EARN_LINK_STRATEGIES) or {}
+
+
+def earn_page_state(condition):
+    # 把探针结果包装成 wait_for 的条件：满足 condition 时返回整个状态
+    def check(driver):
+        state = probe_earn_page(driver)
+        return state if condition(state) else False
+    return check
+
+
+def page_ready(driver):
+    return driver.execute_script("return document.readyState") == "complete"
+
+
+@dataclass
+class CaptchaSolveResult:
+    """process_captcha 的结果"""
+    success: bool = False
+    outcome: str = ""                       # passed / exhausted / timeout / reload_failed
+    attempts: int = 0
+    elapsed: float = 0.0
+    stages: List[Dict[str, float]] = field(default_factory=list)  # 每一轮各阶段耗时（秒）
+
+    def stage_totals(self) -> Dict[str, float]:
+        totals = {}
+        for stages in self.stages:
+            for name, seconds in stages.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+def process_captcha(session, max_attempts=None, time_budget=None) -> CaptchaSolveResult:
+    """
+    在验证码 iframe 内循环识别、点击、提交，直到通过、用完尝试次数或超出总时间预算。
+    本地判断不可解（识别率低、置信度不足）时按最短间隔刷新；
+    提交被拒或页面出错时，刷新前的等待时间逐轮翻倍。
+    """
+    from selenium.common import TimeoutException
+    from selenium.webdriver import ActionChains
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    driver, wait = session.driver, session.wait
+
+    max_attempts = max_attempts or CAPTCHA_MAX_ATTEMPTS
+    time_budget = time_budget or CAPTCHA_TIME_BUDGET
+    result = CaptchaSolveResult()
+    start = time.monotonic()
+    backoff = CAPTCHA_BACKOFF_MIN
+    while True:
+        result.attempts += 1
+        stages = {}
+        result.stages.append(stages)
+        rejected = False
+        captcha_b = sprite_b = recognition = passed = None
+        attempt_start, attempt_error = time.time(), None
+        try:
+            with stage_timer(stages, "download"):
+                captcha_b, sprite_b = download_captcha_img(session)
+            recognition = recognize_captcha(captcha_b, sprite_b, stages)
+            if recognition.status == "ok":
+                logger.info("开始识别验证码")
+                answer = recognition.answer
+                captcha = recognition.captcha
+                with stage_timer(stages, "click"):
                     width_raw, height_raw = captcha.shape[1], captcha.shape[0]
-                    width, height = float(get_width_from_style(style)), float(get_height_from_style(style))
-                    x_offset, y_offset = float(-width / 2), float(-height / 2)
-                    final_x, final_y = int(x_offset + x / width_raw * width), int(y_offset + y / height_raw * height)
-                    ActionChains(driver).move_to_element_with_offset(slideBg, final_x, final_y).click().perform()
-                confirm = wait.until(
-                    EC.element_to_be_clickable((By.XPATH, '//*[@id="tcStatus"]/div[2]/div[2]/div/div')))
-                logger.info("提交验证码")
-                confirm.click()
-                time.sleep(5)
-                result = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="tcOperation"]')))
-                if result.get_attribute("class") == 'tc-opera pointer show-success':
+                    for i, (x, y) in enumerate(answer.positions):
+                        logger.info(f"图案 {i + 1} 位于 ({x},{y})，匹配率：{answer.scores[i]}")
+                        slideBg = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="slideBg"]')))
+                        style = slideBg.get_attribute("style")
+                        width, height = float(get_width_from_style(style)), float(get_height_from_style(style))
+                        x_offset, y_offset = float(-width / 2), float(-height / 2)
+                        final_x, final_y = int(x_offset + x / width_raw * width), int(y_offset + y / height_raw * height)
+                        ActionChains(driver).move_to_element_with_offset(slideBg, final_x, final_y).click().perform()
+                with stage_timer(stages, "submit"):
+                    confirm = wait.until(
+                        EC.element_to_be_clickable((By.XPATH, '//*[@id="tcStatus"]/div[2]/div[2]/div/div')))
+                    operations = driver.find_elements(By.ID, "tcOperation")
+                    before = operations[0].get_attribute("class") if operations else None
+                    logger.info("提交验证码")
+                    confirm.click()
+
+                    def settled(d):
+                        # tcOperation 的 class 变成 show-success，或变成其它 show-* 结果状态
+                        found = d.find_elements(By.ID, "tcOperation")
+                        cls = (found[0].get_attribute("class") or "") if found else ""
+                        return "show-success" in cls or ("show-" in cls and cls != before)
+
+                    wait_for(session, "captcha_result", settled, 5)
+                    operation = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="tcOperation"]')))
+                    passed = operation.get_attribute("class") == 'tc-opera pointer show-success'
+                if passed:
                     logger.info("验证码通过")
-                    return
-                else:
-                    logger.error("验证码未通过，正在重试")
+                    ICON_CACHE.learn(recognition)
+                    result.success = True
+                    result.outcome = "passed"
+                    break
+                logger.error("验证码未通过，正在重试")
+                rejected = True
+            elif recognition.status == "low_confidence":
+                logger.error("验证码识别置信度不足，正在重试")
             else:
-                logger.error("验证码识别失败，正在重试")
-        else:
-            logger.error("当前验证码识别率低，尝试刷新")
-            
-        # 确保在 iframe 内能找到 reload 元素，或者逻辑要切出去
-        # 原逻辑未切换 frame，直接找 reload，这可能导致找不到元素报错
-        # 简单修复：包裹在 try-except 中
-        try:
-             reload = driver.find_element(By.XPATH, '//*[@id="reload"]')
-             time.sleep(2)
-             reload.click()
-             time.sleep(5)
-             process_captcha()
-        except:
-             pass
+                logger.error("当前验证码识别率低，尝试刷新")
+        except TimeoutException as e:
+            logger.error("获取验证码图片失败")
+            rejected = True
+            attempt_error = type(e).__name__
+        except Exception as e:
+            logger.error(f"处理验证码时发生错误: {e}") # 打印具体错误，方便调试
+            rejected = True
+            attempt_error = type(e).__name__
+        finally:
+            CAPTCHA_RECORDER.record(captcha_b, sprite_b, recognition, passed)
+            for name, seconds in stages.items():
+                session.trace.add(f"captcha_{name}", seconds, attempt=result.attempts)
+            session.trace.add("captcha_attempt", time.time() - attempt_start, attempt_error, start=attempt_start,
+                              attempt=result.attempts, status=recognition.status if recognition else None, passed=passed)
 
-    except TimeoutException:
-        logger.error("获取验证码图片失败")
-    except Exception as e:
-        logger.error(f"处理验证码时发生错误: {e}") # 打印具体错误，方便调试
+        if result.attempts >= max_attempts:
+            result.outcome = "exhausted"
+            break
+        delay = backoff if rejected else CAPTCHA_BACKOFF_MIN
+        if time.monotonic() - start + delay >= time_budget:
+            result.outcome = "timeout"
+            break
+        if rejected:
+            backoff = min(backoff * 2, CAPTCHA_BACKOFF_MAX)
 
+        # reload 按钮在验证码 iframe 内；找不到或点不动时不再盲目重试
+        try:
+            with stage_timer(stages, "reload"), session.trace.span("captcha_reload", attempt=result.attempts):
+                reload = driver.find_element(By.XPATH, '//*[@id="reload"]')
+                old_style = driver.find_element(By.ID, "slideBg").get_attribute("style")
+                time.sleep(delay * random.uniform(0.8, 1.2))
+                reload.click()
+                # 等到背景图换成新的图片地址
+                wait_for(session, "captcha_reload", lambda d: any(
+                    el.get_attribute("style") != old_style and "url(" in (el.get_attribute("style") or "")
+                    for el in d.find_elements(By.ID, "slideBg")), 10)
+        except Exception as e:
+            logger.error(f"刷新验证码失败: {e}")
+            result.outcome = "reload_failed"
+            break
 
-def download_captcha_img():
-    # 声明使用全局 wait
-    global wait
-    
-    if os.path.exists("temp"):
-        for filename in os.listdir("temp"):
-            file_path = os.path.join("temp", filename)
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.remove(file_path)
+    result.elapsed = time.monotonic() - start
+    totals = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result.stage_totals().items())
+    logger.info(f"验证码处理结束: {result.outcome}，共 {result.attempts} 轮，耗时 {result.elapsed:.1f}s（{totals}）")
+    return result
+
+
+class CaptchaRecorder:
+    """
+    验证码采集：把每一轮的背景图、图标、检测框、相似度矩阵、点击位置和是否通过记录到数据集目录。
+    图片按 sha256 内容寻址存放在 objects/ 下（重复的图只存一份），每一轮在 index.jsonl 追加一行。
+    设置 CAPTCHA_DATASET_DIR 后启用，bench/captcha.py 可以直接读取该目录。
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def store(self, data) -> Optional[str]:
+        if not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        folder = os.path.join(self.root, "objects", digest[:2])
+        path = os.path.join(folder, digest + ".jpg")
+        if not os.path.exists(path):
+            os.makedirs(folder, exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def record(self, captcha_b, sprite_b, recognition=None, success=None):
+        """success: True 通过，False 提交后被拒，None 未提交"""
+        if not self.enabled or not (captcha_b or sprite_b):
+            return
+        try:
+            entry = {
+                "ts": round(time.time(), 3),
+                "captcha": self.store(captcha_b),
+                "sprite": self.store(sprite_b),
+                "status": recognition.status if recognition else "error",
+                "success": success,
+            }
+            if recognition is not None:
+                entry["bboxes"] = [[int(v) for v in box] for box in recognition.bboxes]
+                if recognition.similarities is not None:
+                    entry["similarities"] = np.round(recognition.similarities, 4).tolist()
+                if recognition.answer is not None:
+                    entry["boxes"] = recognition.answer.boxes
+                    entry["clicks"] = [list(p) for p in recognition.answer.positions]
+                    entry["margin"] = round(recognition.answer.margin, 4)
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            with self._lock:
+                with open(os.path.join(self.root, "index.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            logger.warning(f"记录验证码样本失败: {e}")
+
+
+CAPTCHA_RECORDER = CaptchaRecorder(os.environ.get("CAPTCHA_DATASET_DIR"))
+
+
+def download_captcha_img(session):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait = session.wait
     slideBg = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="slideBg"]')))
     img1_style = slideBg.get_attribute("style")
     img1_url = get_url_from_style(img1_style)
-    logger.info("开始下载验证码图片(1): " + img1_url)
-    download_image(img1_url, "captcha.jpg")
     sprite = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="instruction"]/div/img')))
     img2_url = sprite.get_attribute("src")
-    logger.info("开始下载验证码图片(2): " + img2_url)
-    download_image(img2_url, "sprite.jpg")
+    urls = [img1_url, img2_url]
+    contents = [None, None]
+    if CAPTCHA_IMAGE_SOURCE == "network" and session.network is not None:
+        # 直接用浏览器正在显示的那两张图
+        for i, url in enumerate(urls):
+            contents[i] = session.network.image_body(url)
+            if contents[i]:
+                logger.info(f"验证码图片({i + 1}) 取自浏览器网络层，{len(contents[i])} 字节")
+    missing = [i for i, content in enumerate(contents) if not content]
+    for i in missing:
+        logger.info(f"开始下载验证码图片({i + 1}): " + urls[i])
+    results = CAPTCHA_FETCHER.fetch_all([urls[i] for i in missing]) if missing else []
+    for i, result in zip(missing, results):
+        if result.error:
+            logger.error(f"下载验证码图片({i + 1})失败: {result.error}，尝试 {result.attempts} 次，耗时 {result.elapsed:.2f}s")
+        else:
+            logger.info(f"验证码图片({i + 1}) {result.size} 字节，尝试 {result.attempts} 次，耗时 {result.elapsed:.2f}s")
+        contents[i] = result.content
+    return contents[0], contents[1]
 
 
-def check_captcha() -> bool:
-    # 声明使用全局 ocr
-    global ocr
-    
+def count_contours(segment) -> int:
+    # 二值化后面积不小于图标 1% 的轮廓数（含内孔）："0" 为 2 个，"1" 为 1 个
+    _, binary = cv2.threshold(segment, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = segment.shape[0] * segment.shape[1] * 0.01
+    return sum(1 for contour in contours if cv2.contourArea(contour) >= min_area)
+
+
+def classify_segments(ocr, segments):
+    """依次产出每个图标的 OCR 结果（生成器，调用方拿到想要的结果即可停止）"""
+    for segment in segments:
+        yield ocr.classification(Image.fromarray(cv2.cvtColor(segment, cv2.COLOR_BGR2RGB)))
+
+
+def check_captcha(raw) -> bool:
     try:
-        raw = cv2.imread("temp/sprite.jpg")
         if raw is None: return False
         
         gray = cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY)
         laplacian = cv2.Laplacian(gray, cv2.CV_64F).var()
         if laplacian < 50: return False
-            
-        h, w = raw.shape[:2]
-        for i in range(3):
-            w_segment = w // 3
-            start_x = max(0, w_segment * i + 2)
-            end_x = min(w, w_segment * (i + 1) - 2)
-            temp = raw[:, start_x:end_x]
-            cv2.imwrite(f"temp/sprite_{i + 1}.jpg", temp)
-            
-            with open(f"temp/sprite_{i + 1}.jpg", mode="rb") as f:
-                temp_rb = f.read()
-            try:
-                result = ocr.classification(temp_rb)
-                if result in ["0", "1"]: return False
-            except Exception:
-                return False
-        return True
+
+        # 廉价的结构判断先行：轮廓足够多的图标不可能被读成 "0"/"1"，不必送 OCR（默认关闭）；
+        # 其余图标按轮廓数从少到多识别，最像 "0"/"1" 的先识别，命中即可提前结束
+        segments = split_sprite(raw)
+        contours = [count_contours(segment) for segment in split_sprite(gray)]
+        pending = [segments[i] for i in sorted(range(len(segments)), key=lambda i: contours[i])
+                   if not CAPTCHA_GATE_MIN_CONTOURS or contours[i] < CAPTCHA_GATE_MIN_CONTOURS]
+        if not pending: return True
+        with OCR_MODELS.acquire() as ocr:
+            return not any(result in ["0", "1"] for result in classify_segments(ocr, pending))
     except Exception:
         return False
 
 
-def check_answer(d: dict) -> bool:
-    flipped = dict()
-    for key in d.keys():
-        flipped[d[key]] = key
-    if len(d.values()) != len(flipped.keys()):
+@dataclass
+class CaptchaAnswer:
+    """图标到候选框的最优分配结果"""
+    boxes: List[int]                    # 每个图标选中的候选框下标
+    scores: List[float]                 # 每个图标与所选框的相似度
+    positions: List[Tuple[int, int]]    # 每个图标的点击位置（原图坐标）
+    total: float                        # 最优分配的总分
+    margin: float                       # 最优与次优分配的总分差
+
+
+def solve_assignment(similarities, bboxes=None) -> Optional[CaptchaAnswer]:
+    """
+    把相似度矩阵当作指派问题求全局最优，而不是每个图标各自贪心取最大值。
+    图标只有 3 个、候选框通常不到 10 个，直接枚举全部排列即可。
+    """
+    matrix = np.asarray(similarities, dtype=np.float64)
+    if matrix.ndim != 2 or matrix.shape[0] == 0:
+        return None
+    n_sprites, n_boxes = matrix.shape
+    if n_boxes < n_sprites:
+        return None
+    perms = np.array(list(itertools.permutations(range(n_boxes), n_sprites)))
+    totals = matrix[np.arange(n_sprites), perms].sum(axis=1)
+    order = np.argsort(totals)[::-1]
+    best = perms[order[0]]
+    margin = totals[order[0]] - totals[order[1]] if len(order) > 1 else totals[order[0]]
+    positions = []
+    for i in (best if bboxes is not None else []):
+        x1, y1, x2, y2 = bboxes[i]
+        positions.append((int((x1 + x2) / 2), int((y1 + y2) / 2)))
+    return CaptchaAnswer(
+        boxes=[int(i) for i in best],
+        scores=[float(matrix[j, i]) for j, i in enumerate(best)],
+        positions=positions,
+        total=float(totals[order[0]]),
+        margin=float(margin),
+    )
+
+
+def check_answer(answer: Optional[CaptchaAnswer]) -> bool:
+    # 候选框不足、最优方案与次优方案无法区分或有图标匹配率过低时直接刷新，不去点击
+    if answer is None:
+        return False
+    if answer.margin <= CAPTCHA_MIN_MARGIN:
+        return False
+    if min(answer.scores) < CAPTCHA_MIN_SCORE:
         return False
     return True
 
@@ -255,192 +1663,816 @@ def preprocess_image(image):
     morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
     return morph
 
-def compute_similarity(img1_path, img2_path):
-    img1 = cv2.imread(img1_path, cv2.IMREAD_GRAYSCALE)
-    img2 = cv2.imread(img2_path, cv2.IMREAD_GRAYSCALE)
-    if img1 is None or img2 is None: return 0.0, 0
-    
-    scale = 100.0 / max(img1.shape) if max(img1.shape) > 100 else 1.0
-    img1 = cv2.resize(img1, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-    scale = 100.0 / max(img2.shape) if max(img2.shape) > 100 else 1.0
-    img2 = cv2.resize(img2, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-    
-    img1 = preprocess_image(img1)
-    img2 = preprocess_image(img2)
+def to_gray(image):
+    if image is None or image.size == 0:
+        return None
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
 
-    try:
-        sift = cv2.SIFT_create()
-        kp1, des1 = sift.detectAndCompute(img1, None)
-        kp2, des2 = sift.detectAndCompute(img2, None)
+
+_scoring_pool = None
+_scoring_pool_lock = threading.Lock()
+
+
+def parallel_map(func, items) -> list:
+    """
+    在打分线程池上执行 func。OpenCV 的特征提取和匹配会释放 GIL，多核机器上线程可以真正并行。
+    CAPTCHA_WORKERS <= 1 或任务数少于 CAPTCHA_PARALLEL_MIN_ITEMS 时直接串行，省掉调度开销。
+    """
+    global _scoring_pool
+    if CAPTCHA_WORKERS <= 1 or len(items) < CAPTCHA_PARALLEL_MIN_ITEMS:
+        return [func(item) for item in items]
+    with _scoring_pool_lock:
+        if _scoring_pool is None:
+            _scoring_pool = ThreadPoolExecutor(max_workers=CAPTCHA_WORKERS, thread_name_prefix="captcha-score")
+    return list(_scoring_pool.map(func, items))
+
+
+class CaptchaMatcher:
+    """
+    单张验证码的相似度计算基类。
+    图标与候选框各只做一次缩放、预处理和特征提取（describe），再由缓存的特征计算 3×N 相似度矩阵（score）。
+    子类只需实现 describe 和 score，用 CAPTCHA_MATCHER 选择具体实现。
+    """
+    name = ""
+
+    def __init__(self, prepared=False):
+        # prepared 为 True 时输入已是 preprocess_image 的结果（CAPTCHA_PREPROCESS=full），只需缩放
+        self.prepared = prepared
+        self.sprite_features = []
+        self.crop_features = []
+
+    def normalize(self, image):
+        image = to_gray(image)
+        if image is None:
+            return None
+        scale = 100.0 / max(image.shape) if max(image.shape) > 100 else 1.0
+        if self.prepared:
+            if scale == 1.0:
+                return image
+            # 二值图用最近邻缩放，保持只有 0/255 两种取值
+            return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return preprocess_image(image)
+
+    def describe(self, image):
+        raise NotImplementedError
+
+    def score(self, f1, f2):
+        # 返回 (相似度, 匹配点数)
+        raise NotImplementedError
+
+    def set_sprites(self, sprites, features=None):
+        # features 可以给出部分图标的现成特征（如图标缓存里的描述子），为 None 的才重新提取
+        sprites = list(sprites)
+        features = list(features) if features is not None else [None] * len(sprites)
+        missing = [k for k, feature in enumerate(features) if feature is None]
+        for k, feature in zip(missing, parallel_map(self.describe, [sprites[k] for k in missing])):
+            features[k] = feature
+        self.sprite_features = features
+
+    def set_crops(self, crops):
+        self.crop_features = parallel_map(self.describe, list(crops))
+
+    def similarity_matrix(self):
+        # matrix[j, i]：第 j 个图标与第 i 个候选框的相似度
+        matrix = np.zeros((len(self.sprite_features), len(self.crop_features)), dtype=np.float64)
+        pairs = [(j, i) for j in range(len(self.sprite_features)) for i in range(len(self.crop_features))]
+        scores = parallel_map(lambda pair: self.score(self.sprite_features[pair[0]], self.crop_features[pair[1]])[0], pairs)
+        for (j, i), value in zip(pairs, scores):
+            matrix[j, i] = value
+        return matrix
+
+
+class SiftMatcher(CaptchaMatcher):
+    """SIFT + FLANN，最准也最慢；SIFT / FLANN 实例每个线程各一份，跨验证码复用"""
+    name = "sift"
+    _local = threading.local()
+
+    @staticmethod
+    def tools():
+        # 当前线程的 (SIFT, FLANN)
+        local = SiftMatcher._local
+        if getattr(local, "sift", None) is None:
+            local.sift = cv2.SIFT_create()
+            local.flann = cv2.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
+        return local.sift, local.flann
+
+    def describe(self, image):
+        # 返回 (关键点数量, 描述子)，失败时描述子为 None
+        image = self.normalize(image)
+        if image is None:
+            return 0, None
+        try:
+            kp, des = self.tools()[0].detectAndCompute(image, None)
+            return len(kp), des
+        except Exception:
+            return 0, None
+
+    def score(self, f1, f2):
+        kp1, des1 = f1
+        kp2, des2 = f2
         if des1 is None or des2 is None: return 0.0, 0
+        try:
+            matches = self.tools()[1].knnMatch(des1, des2, k=2)
+            good = [m for m, n in matches if m.distance < 0.7 * n.distance]
 
-        flann = cv2.FlannBasedMatcher(dict(algorithm=1, trees=5), dict(checks=50))
-        matches = flann.knnMatch(des1, des2, k=2)
-        good = [m for m, n in matches if m.distance < 0.7 * n.distance]
-        
-        if len(good) == 0: return 0.0, 0
-        feature_factor = min(1.0, len(kp1) / 100.0, len(kp2) / 100.0)
-        match_ratio = len(good) / min(len(des1), len(des2))
-        return match_ratio * 0.7 + feature_factor * 0.3, len(good)
+            if len(good) == 0: return 0.0, 0
+            feature_factor = min(1.0, kp1 / 100.0, kp2 / 100.0)
+            match_ratio = len(good) / min(len(des1), len(des2))
+            return match_ratio * 0.7 + feature_factor * 0.3, len(good)
+        except Exception:
+            return 0.0, 0
+
+
+class OrbMatcher(CaptchaMatcher):
+    """ORB 二进制描述子 + 汉明距离暴力匹配，打分方式与 SIFT 相同；实例每个线程各一份"""
+    name = "orb"
+    _local = threading.local()
+
+    @staticmethod
+    def tools():
+        # 当前线程的 (ORB, BFMatcher)
+        local = OrbMatcher._local
+        if getattr(local, "orb", None) is None:
+            # 图标只有 100 像素左右，边缘阈值和 patch 都要调小，否则几乎提取不到关键点
+            local.orb = cv2.ORB_create(nfeatures=200, edgeThreshold=8, patchSize=15)
+            local.bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+        return local.orb, local.bf
+
+    def describe(self, image):
+        image = self.normalize(image)
+        if image is None:
+            return 0, None
+        try:
+            kp, des = self.tools()[0].detectAndCompute(image, None)
+            return len(kp), des
+        except Exception:
+            return 0, None
+
+    def score(self, f1, f2):
+        kp1, des1 = f1
+        kp2, des2 = f2
+        if des1 is None or des2 is None or len(des2) < 2: return 0.0, 0
+        try:
+            matches = self.tools()[1].knnMatch(des1, des2, k=2)
+            good = [m[0] for m in matches if len(m) == 2 and m[0].distance < 0.75 * m[1].distance]
+
+            if len(good) == 0: return 0.0, 0
+            feature_factor = min(1.0, kp1 / 100.0, kp2 / 100.0)
+            match_ratio = len(good) / min(len(des1), len(des2))
+            return match_ratio * 0.7 + feature_factor * 0.3, len(good)
+        except Exception:
+            return 0.0, 0
+
+
+class TemplateMatcher(CaptchaMatcher):
+    """把预处理后的图缩放到同一尺寸，计算归一化相关系数"""
+    name = "template"
+    size = 48
+
+    def describe(self, image):
+        image = self.normalize(image)
+        if image is None:
+            return None
+        return cv2.resize(image, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def score(self, f1, f2):
+        if f1 is None or f2 is None: return 0.0, 0
+        value = float(cv2.matchTemplate(f1, f2, cv2.TM_CCOEFF_NORMED)[0, 0])
+        if not np.isfinite(value): return 0.0, 0
+        return max(0.0, value), 0
+
+
+class ShapeMatcher(CaptchaMatcher):
+    """取最大轮廓的 Hu 矩做形状匹配，对缩放和旋转不敏感"""
+    name = "shape"
+
+    def describe(self, image):
+        image = self.normalize(image)
+        if image is None:
+            return None
+        contours, _ = cv2.findContours(255 - image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+        return max(contours, key=cv2.contourArea)
+
+    def score(self, f1, f2):
+        if f1 is None or f2 is None: return 0.0, 0
+        try:
+            distance = cv2.matchShapes(f1, f2, cv2.CONTOURS_MATCH_I1, 0.0)
+        except Exception:
+            return 0.0, 0
+        return float(np.exp(-distance)), 0
+
+
+class CascadeMatcher(CaptchaMatcher):
+    """
+    级联：先用便宜的后端算相似度矩阵，最优分配足够明确（与次优方案的分差和最低匹配率都达标）就直接采用，
+    否则逐级升级，最后一级总是 SIFT。各级依次由 CAPTCHA_CASCADE 指定，默认 template,orb。
+    """
+    name = "cascade"
+
+    def __init__(self, stages=None, margin=None, min_score=None, prepared=False):
+        super().__init__(prepared)
+        stages = stages if stages is not None else CAPTCHA_CASCADE
+        self.stages = [MATCHERS[name] for name in stages if name in MATCHERS and name not in ("sift", "cascade")]
+        self.stages.append(SiftMatcher)
+        self.margin = CAPTCHA_CASCADE_MARGIN if margin is None else margin
+        self.min_score = CAPTCHA_CASCADE_MIN_SCORE if min_score is None else min_score
+        self.sprites = []
+        self.crops = []
+        self.used = []
+
+    def set_sprites(self, sprites, features=None):
+        self.sprites = list(sprites)
+
+    def set_crops(self, crops):
+        self.crops = list(crops)
+
+    def similarity_matrix(self):
+        self.used = []
+        matrix = None
+        for i, stage in enumerate(self.stages):
+            matcher = stage(prepared=self.prepared)
+            matcher.set_sprites(self.sprites)
+            matcher.set_crops(self.crops)
+            matrix = matcher.similarity_matrix()
+            self.used.append(matcher.name)
+            if i == len(self.stages) - 1:
+                break
+            answer = solve_assignment(matrix)
+            if answer is not None and answer.margin >= self.margin and min(answer.scores) >= self.min_score:
+                break
+        return matrix
+
+
+MATCHERS = {
+    "sift": SiftMatcher,
+    "orb": OrbMatcher,
+    "template": TemplateMatcher,
+    "shape": ShapeMatcher,
+    "cascade": CascadeMatcher,
+}
+
+
+def create_matcher(name=None, prepared=False) -> CaptchaMatcher:
+    name = (name or CAPTCHA_MATCHER).lower()
+    if name not in MATCHERS:
+        logger.warning(f"未知的 CAPTCHA_MATCHER: {name}，使用 sift")
+        name = "sift"
+    return MATCHERS[name](prepared=prepared)
+
+
+def prepare_full(image):
+    """CAPTCHA_PREPROCESS=full：整张图转灰度并滤波一次，之后的候选框和图标都从结果上切片"""
+    gray = to_gray(image)
+    return None if gray is None else preprocess_image(gray)
+
+
+def phash(image) -> int:
+    """64 位感知哈希：灰度缩放到 32×32 做 DCT，取左上 8×8 低频系数与中位数比较"""
+    gray = to_gray(image)
+    if gray is None:
+        return 0
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(hashes, value):
+    # hashes 为 uint64 数组，返回每一项与 value 的汉明距离
+    diff = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(diff.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def to_signed(value) -> int:
+    # SQLite 的 INTEGER 是有符号 64 位
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class IconCache:
+    """
+    已知验证码图标的持久化缓存（SQLite），以图标的感知哈希为键：
+      icons   表保存图标的 SIFT 描述子，下次遇到同一图标时不必重新提取；
+      matches 表保存验证通过时每个图标实际点中的候选框的哈希。
+    新一轮验证码中，若图标命中缓存且恰好只有一个候选框与它以前匹配过的框相近，
+    这一行直接记为确定匹配，不再跑相似度计算。两张表都按最近使用时间淘汰，条目数不超过 CAPTCHA_ICON_CACHE_MAX。
+    """
+
+    def __init__(self, path=None, max_entries=5000, distance=8):
+        self.path = path
+        self.max_entries = max_entries
+        self.distance = distance
+        self._conn = None
+        self._matches = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("CREATE TABLE IF NOT EXISTS icons (hash INTEGER PRIMARY KEY, keypoints INTEGER, "
+                         "descriptors BLOB, hits INTEGER DEFAULT 0, last_used REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS matches (icon INTEGER, crop INTEGER, hits INTEGER DEFAULT 0, "
+                         "last_used REAL, PRIMARY KEY (icon, crop))")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_matches(self):
+        # matches 表条目数有上限，整表载入内存，用 numpy 批量算汉明距离
+        if self._matches is None:
+            rows = self._connect().execute("SELECT icon, crop FROM matches").fetchall()
+            icons = np.array([row[0] for row in rows], dtype=np.int64).view(np.uint64)
+            crops = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+            self._matches = (icons, crops)
+        return self._matches
+
+    def lookup(self, sprite_hashes, crop_hashes) -> Dict[int, int]:
+        """返回 {图标下标: 候选框下标}，只包含能唯一确定、且互不冲突的图标"""
+        with self._lock:
+            icons, crops = self._load_matches()
+        if len(icons) == 0 or not crop_hashes:
+            return {}
+        crop_array = np.array(crop_hashes, dtype=np.uint64)
+        known = {}
+        for j, value in enumerate(sprite_hashes):
+            seen = crops[hamming(icons, value) <= self.distance]
+            if len(seen) == 0:
+                continue
+            hits = [i for i in range(len(crop_hashes)) if hamming(seen, crop_array[i]).min() <= self.distance]
+            if len(hits) == 1:
+                known[j] = hits[0]
+        boxes = list(known.values())
+        return {j: i for j, i in known.items() if boxes.count(i) == 1}
+
+    def sprite_features(self, sprite_hashes) -> Dict[int, tuple]:
+        """从 icons 表取图标的 SIFT 特征，返回 {图标下标: (关键点数量, 描述子)}"""
+        features = {}
+        with self._lock:
+            conn = self._connect()
+            for j, value in enumerate(sprite_hashes):
+                row = conn.execute("SELECT keypoints, descriptors FROM icons WHERE hash = ?",
+                                   (to_signed(value),)).fetchone()
+                if row and row[1]:
+                    features[j] = (row[0], np.frombuffer(row[1], dtype=np.float32).reshape(-1, 128))
+        return features
+
+    def similarity_matrix(self, matcher, sprites, crops, recognition):
+        recognition.sprite_hashes = [phash(sprite) for sprite in sprites]
+        recognition.crop_hashes = [phash(crop) for crop in crops]
+        try:
+            known = self.lookup(recognition.sprite_hashes, recognition.crop_hashes)
+            cached = self.sprite_features(recognition.sprite_hashes) if matcher.name == "sift" else {}
+        except Exception as e:
+            logger.warning(f"读取图标缓存失败: {e}")
+            known, cached = {}, {}
+
+        matrix = np.zeros((len(sprites), len(crops)), dtype=np.float64)
+        pending = [j for j in range(len(sprites)) if j not in known]
+        names = ["cache"] if known else []
+        if pending and crops:
+            matcher.set_sprites([sprites[j] for j in pending], [cached.get(j) for j in pending])
+            matcher.set_crops(crops)
+            matrix[pending] = matcher.similarity_matrix()
+            names.extend(getattr(matcher, "used", None) or [matcher.name])
+            if matcher.name == "sift":
+                recognition.sprite_features = {
+                    j: feature for j, feature in zip(pending, matcher.sprite_features) if j not in cached
+                }
+        for j, i in known.items():
+            matrix[j, i] = 1.0
+        recognition.matcher = ">".join(names)
+        return matrix
+
+    def learn(self, recognition):
+        """验证通过后记录图标与点中的候选框"""
+        if not self.enabled or recognition is None or recognition.answer is None or not recognition.sprite_hashes:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                for j, i in enumerate(recognition.answer.boxes):
+                    icon = to_signed(recognition.sprite_hashes[j])
+                    crop = to_signed(recognition.crop_hashes[i])
+                    keypoints, descriptors = recognition.sprite_features.get(j, (None, None))
+                    conn.execute("INSERT INTO icons (hash, keypoints, descriptors, hits, last_used) VALUES (?, ?, ?, 1, ?) "
+                                 "ON CONFLICT(hash) DO UPDATE SET hits = hits + 1, last_used = excluded.last_used, "
+                                 "keypoints = COALESCE(excluded.keypoints, keypoints), "
+                                 "descriptors = COALESCE(excluded.descriptors, descriptors)",
+                                 (icon, keypoints,
+                                  descriptors.astype(np.float32).tobytes() if descriptors is not None else None, now))
+                    conn.execute("INSERT INTO matches (icon, crop, hits, last_used) VALUES (?, ?, 1, ?) "
+                                 "ON CONFLICT(icon, crop) DO UPDATE SET hits = hits + 1, last_used = excluded.last_used",
+                                 (icon, crop, now))
+                for table in ("icons", "matches"):
+                    conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} "
+                                 f"ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                conn.commit()
+                self._matches = None
+        except Exception as e:
+            logger.warning(f"写入图标缓存失败: {e}")
+
+
+ICON_CACHE = IconCache(CAPTCHA_ICON_CACHE, CAPTCHA_ICON_CACHE_MAX, CAPTCHA_ICON_HASH_DISTANCE)
+
+
+@contextmanager
+def stage_timer(stages, name, cpu_stages=None):
+    # 把代码块耗时累加到 stages[name]；传入 cpu_stages 时同时累加进程 CPU 时间
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+        if cpu_stages is not None:
+            cpu_stages[name] = cpu_stages.get(name, 0.0) + time.process_time() - cpu_start
+
+
+@dataclass
+class CaptchaRecognition:
+    """一轮验证码的识别结果，只做图像处理，不涉及浏览器操作"""
+    captcha: object = None                  # 解码后的背景图
+    bboxes: list = field(default_factory=list)
+    similarities: object = None             # 3×N 相似度矩阵
+    answer: Optional[CaptchaAnswer] = None
+    status: str = ""                        # ok / decode_failed / gate_rejected / low_confidence
+    matcher: str = ""                       # 实际参与打分的后端，级联时形如 template>orb>sift
+    sprite_hashes: list = field(default_factory=list)   # 各图标的感知哈希（启用图标缓存时）
+    crop_hashes: list = field(default_factory=list)     # 各候选框的感知哈希（启用图标缓存时）
+    sprite_features: dict = field(default_factory=dict) # 本轮新提取的图标 SIFT 特征，通过后写入缓存
+
+
+def recognize_captcha(captcha_b, sprite_b, stages=None, cpu_stages=None, matcher=None) -> CaptchaRecognition:
+    stages = {} if stages is None else stages
+    recognition = CaptchaRecognition()
+    with stage_timer(stages, "decode", cpu_stages):
+        captcha = decode_image(captcha_b)
+        sprite = decode_image(sprite_b)
+    recognition.captcha = captcha
+    if captcha is None or sprite is None:
+        recognition.status = "decode_failed"
+        return recognition
+    with stage_timer(stages, "gate", cpu_stages):
+        passed = check_captcha(sprite)
+    if not passed:
+        recognition.status = "gate_rejected"
+        return recognition
+    with stage_timer(stages, "detect", cpu_stages):
+        with DET_MODELS.acquire() as det:
+            recognition.bboxes = det.detection(captcha_b)
+    with stage_timer(stages, "match", cpu_stages):
+        full = CAPTCHA_PREPROCESS == "full"
+        matcher = create_matcher(matcher, prepared=full)
+        background = prepare_full(captcha) if full else captcha
+        sprites = split_sprite(prepare_full(sprite) if full else sprite)
+        crops = [background[y1:y2, x1:x2] for x1, y1, x2, y2 in recognition.bboxes]
+        if ICON_CACHE.enabled:
+            recognition.similarities = ICON_CACHE.similarity_matrix(matcher, sprites, crops, recognition)
+        else:
+            matcher.set_sprites(sprites)
+            matcher.set_crops(crops)
+            recognition.similarities = matcher.similarity_matrix()
+            recognition.matcher = ">".join(getattr(matcher, "used", None) or [matcher.name])
+    with stage_timer(stages, "assign", cpu_stages):
+        recognition.answer = solve_assignment(recognition.similarities, recognition.bboxes)
+    recognition.status = "ok" if check_answer(recognition.answer) else "low_confidence"
+    return recognition
+
+
+# 签到方式：auto 先走纯 HTTP 接口，需要验证码或接口出错时再启动浏览器；http 只走接口；browser 只用浏览器
+RAINYUN_ENGINE = os.environ.get("RAINYUN_ENGINE", "auto").lower()
+# 接口地址，可指向本地的替身服务做测试
+RAINYUN_API_BASE = os.environ.get("RAINYUN_API_BASE", "https://api.v2.rainyun.com").rstrip("/")
+RAINYUN_API_TIMEOUT = float(os.environ.get("RAINYUN_API_TIMEOUT", "15"))
+DAILY_TASK_NAME = "每日签到"
+# 任务列表中的 Status：0 未完成、1 已完成待领取、2 已领取；出现其他取值说明接口与预期不符，按失败处理并退回浏览器
+TASK_STATUS_PENDING = (0, 1)
+TASK_STATUS_CLAIMED = 2
+
+
+class CaptchaRequired(Exception):
+    """接口要求完成腾讯验证码（vticket / vrandstr），纯 HTTP 方式无法继续"""
+
+
+class RainyunApiError(Exception):
+    def __init__(self, path, code, message):
+        super().__init__(f"{path} 返回 {code}: {message}")
+        self.code = code
+
+
+class RainyunApi:
+    """
+    雨云 v2 接口的最小客户端，与 login/rainyun_login_test.py 的 RainyunLogin 一样使用普通的 requests 会话。
+    登录后服务端通过 Cookie 下发 X-CSRF-Token，之后的请求都要带上同名请求头。
+    """
+    CAPTCHA_HINTS = ("验证码", "captcha", "vticket", "人机验证")
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or RAINYUN_API_BASE).rstrip("/")
+        self.timeout = timeout or RAINYUN_API_TIMEOUT
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        })
+
+    def request(self, method, path, payload=None):
+        headers = {}
+        csrf = self.session.cookies.get("X-CSRF-Token")
+        if csrf:
+            headers["X-CSRF-Token"] = csrf
+        response = self.session.request(method, self.base_url + path, json=payload, headers=headers, timeout=self.timeout)
+        try:
+            result = response.json()
+        except ValueError:
+            raise RainyunApiError(path, response.status_code, "响应不是 JSON")
+        code = result.get("code", response.status_code)
+        if code == 200:
+            return result.get("data")
+        message = str(result.get("message", ""))
+        if any(hint in message.lower() for hint in self.CAPTCHA_HINTS):
+            raise CaptchaRequired(f"{path}: {message}")
+        raise RainyunApiError(path, code, message or "未知错误")
+
+    def login(self, user, pwd):
+        return self.request("POST", "/user/login", {"field": user, "password": pwd})
+
+    def points(self) -> int:
+        data = self.request("GET", "/user/") or {}
+        return int(data.get("Points", 0) or 0)
+
+    def tasks(self) -> list:
+        return self.request("GET", "/user/reward/tasks") or []
+
+    def claim(self, task_name):
+        return self.request("POST", "/user/reward/tasks", {"task_name": task_name, "verifyCode": ""})
+
+
+def daily_task_status(api) -> int:
+    task = next((t for t in api.tasks() if t.get("Name") == DAILY_TASK_NAME), None)
+    if task is None:
+        raise RainyunApiError("/user/reward/tasks", 200, f"任务列表中没有“{DAILY_TASK_NAME}”")
+    status = task.get("Status")
+    if status != TASK_STATUS_CLAIMED and status not in TASK_STATUS_PENDING:
+        raise RainyunApiError("/user/reward/tasks", 200, f"“{DAILY_TASK_NAME}”的状态 {status!r} 无法识别")
+    return status
+
+
+def sign_in_http(user, pwd):
+    """
+    纯 HTTP 签到，返回值与 sign_in_account 相同；需要验证码时抛出 CaptchaRequired。
+    只有任务列表里的“每日签到”确实显示为已领取才算成功，领取接口返回 200 也要重新读取任务列表确认。
+    """
+    api = RainyunApi()
+    start = time.monotonic()
+    logger.info(f"通过接口登录: {user}")
+    api.login(user, pwd)
+    if daily_task_status(api) == TASK_STATUS_CLAIMED:
+        logger.info("‘每日签到’显示已完成，跳过当前账号")
+    else:
+        logger.info("领取‘每日签到’奖励")
+        api.claim(DAILY_TASK_NAME)
+        if daily_task_status(api) != TASK_STATUS_CLAIMED:
+            raise RainyunApiError("/user/reward/tasks", 200, f"领取后“{DAILY_TASK_NAME}”仍未显示为已领取")
+    current_points = api.points()
+    logger.info(f"当前剩余积分: {current_points} | 约为 {current_points / 2000:.2f} 元（接口签到耗时 {time.monotonic() - start:.1f}s）")
+    return True, user, current_points, None
+
+
+def sign_in(user, pwd, debug=False, headless=False, pool=None):
+    """按 RAINYUN_ENGINE 选择签到方式；auto 模式下接口需要验证码或出错时退回浏览器"""
+    trace = SpanTrace(user)
+    result = _sign_in(user, pwd, debug, headless, pool, trace)
+    TRACE_EXPORTER.export(trace, result)
+    return result
+
+
+def _sign_in(user, pwd, debug, headless, pool, trace):
+    if RAINYUN_ENGINE in ("auto", "http"):
+        try:
+            with trace.span("http_sign_in"):
+                return sign_in_http(user, pwd)
+        except CaptchaRequired as e:
+            reason = f"接口要求验证码: {e}"
+        except Exception as e:
+            reason = f"接口签到失败: {e}"
+        if RAINYUN_ENGINE == "http":
+            logger.error(reason)
+            return False, user, 0, reason
+        logger.warning(f"{reason}，改用浏览器")
+    return sign_in_account(user, pwd, debug=debug, headless=headless, pool=pool, trace=trace)
+
+
+def resume_session(session) -> bool:
+    """恢复保存的登录会话并打开赚取积分页；页面出现“每日签到”且没有被重定向到登录页即视为有效"""
+    from selenium.common import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    driver = session.driver
+    if not SESSION_JAR.restore(driver, session.user):
+        return False
+    driver.get("https://app.rainyun.com/account/reward/earn")
+    try:
+        session.wait.until(EC.any_of(
+            EC.url_contains("/auth/login"),
+            EC.presence_of_element_located((By.XPATH, "//span[contains(text(),'每日签到')]")),
+        ))
+    except TimeoutException:
+        pass
+    if "/auth/login" not in driver.current_url and driver.find_elements(By.XPATH, "//span[contains(text(),'每日签到')]"):
+        logger.info("登录会话有效，跳过登录")
+        return True
+    logger.info("登录会话已失效，重新登录")
+    SESSION_JAR.discard(session.user)
+    # 恢复的 Cookie 和 localStorage 都要清掉，重新登录时从干净的状态开始
+    try:
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": RAINYUN_APP_ORIGIN, "storageTypes": "all"})
     except Exception:
-        return 0.0, 0
+        pass
+    return False
+
 
+def sign_in_account(user, pwd, debug=False, headless=False, pool=None, trace=None):
+    from selenium.common import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.wait import WebDriverWait
 
-def sign_in_account(user, pwd, debug=False, headless=False):
     timeout = 15
-    driver = None
-    
-    # --- 修复4：声明全局变量，以便 process_captcha 调用 ---
-    global ocr, det, wait 
+    # 未传入浏览器池时单独启动一个浏览器，用完即关
+    own_pool = pool is None
+    if own_pool:
+        pool = BrowserPool(1, 1, debug=debug, headless=headless)
+    trace = trace if trace is not None else SpanTrace(user)
+    session = None
     
     try:
         logger.info(f"开始处理账户: {user}")
         if not debug:
             time.sleep(random.randint(5, 10))
         
-        logger.info("初始化 ddddocr")
-        ocr = ddddocr.DdddOcr(ocr=True, show_ad=False)
-        det = ddddocr.DdddOcr(det=True, show_ad=False)
-        
-        logger.info("初始化 Selenium")
-        driver = init_selenium(debug=debug, headless=headless)
-        
-        # 临时将 driver 设为全局，供 process_captcha 使用
-        globals()['driver'] = driver 
-        
-        try:
-            with open("stealth.min.js", mode="r") as f: js = f.read()
-            driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": js})
-        except: pass
-        
-        logger.info("发起登录请求")
-        driver.get("https://app.rainyun.com/auth/login")
-        wait = WebDriverWait(driver, timeout)
-        
-        # 登录流程
-        username = wait.until(EC.visibility_of_element_located((By.NAME, 'login-field')))
-        password = wait.until(EC.visibility_of_element_located((By.NAME, 'login-password')))
-        try:
-            login_button = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="app"]/div[1]/div[1]/div/div[2]/fade/div/div/span/form/button')))
-        except:
-            login_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')))
+        with pool.acquire(trace) as driver, \
+                account_session(user, driver, WebDriverWait(driver, timeout), trace) as session:
+            wait = session.wait
+            with trace.span("session_restore"):
+                restored = resume_session(session)
+            login_captcha = None
+            if not restored:
+                with trace.span("login_page_load"):
+                    logger.info("发起登录请求")
+                    driver.get("https://app.rainyun.com/auth/login")
             
-        username.clear()
-        password.clear()
-        username.send_keys(user)
-        time.sleep(0.5)
-        password.send_keys(pwd)
-        time.sleep(0.5)
-        driver.execute_script("arguments[0].click();", login_button)
+                    # 登录流程
+                    username = wait.until(EC.visibility_of_element_located((By.NAME, 'login-field')))
+                    password = wait.until(EC.visibility_of_element_located((By.NAME, 'login-password')))
+                    try:
+                        login_button = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="app"]/div[1]/div[1]/div/div[2]/fade/div/div/span/form/button')))
+                    except:
+                        login_button = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[type="submit"]')))
+            
+                with trace.span("login_submit"):
+                    username.clear()
+                    password.clear()
+                    username.send_keys(user)
+                    password.send_keys(pwd)
+                    # 确认两个输入框都已经是完整的值再点登录
+                    wait_for(session, "login_input", lambda d: username.get_attribute("value") == user
+                             and password.get_attribute("value") == pwd, 3)
+                    driver.execute_script("arguments[0].click();", login_button)
         
-        # 登录验证码
-        try:
-            wait.until(EC.visibility_of_element_located((By.ID, 'tcaptcha_iframe_dy')))
-            logger.warning("触发验证码！")
-            driver.switch_to.frame("tcaptcha_iframe_dy")
-            process_captcha()
-        except TimeoutException:
-            logger.info("未触发验证码")
+                    # 登录验证码：验证码弹出或直接跳转到控制台，先发生哪个就按哪个处理
+                    outcome = wait_for(session, "login_response", EC.any_of(
+                        EC.visibility_of_element_located((By.ID, 'tcaptcha_iframe_dy')),
+                        EC.url_contains("dashboard"),
+                    ), timeout)
+                if outcome is not None and "dashboard" not in driver.current_url:
+                    logger.warning("触发验证码！")
+                    driver.switch_to.frame("tcaptcha_iframe_dy")
+                    login_captcha = process_captcha(session)
+                else:
+                    logger.info("未触发验证码")
         
-        time.sleep(5)
-        driver.switch_to.default_content()
+                driver.switch_to.default_content()
+                with trace.span("login_redirect"):
+                    wait_for(session, "login_redirect", EC.url_contains("dashboard"), timeout)
         
-        if "dashboard" in driver.current_url:
-            logger.info("登录成功！")
-            logger.info("正在转到赚取积分页")
+            # 赚取积分页的验证码没有通过时不能报告成功
+            captcha_failure = None
+            if restored or "dashboard" in driver.current_url:
+                if not restored:
+                    logger.info("登录成功！")
+                SESSION_JAR.save(driver, user)
+                logger.info("正在转到赚取积分页")
             
-            # --- 修复5：给点击操作增加稳定性 ---
-            for _ in range(3):
-                try:
-                    driver.get("https://app.rainyun.com/account/reward/earn")
-                    wait.until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-                    time.sleep(3)
+                with trace.span("earn_navigation"):
+                    # --- 修复5：给点击操作增加稳定性 ---
+                    for _ in range(3):
+                        try:
+                            driver.get("https://app.rainyun.com/account/reward/earn")
+                            wait.until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+                            # 任务列表渲染出“每日签到”这一行；之后页面状态都由一次探针取回
+                            state = wait_for(session, "earn_page", earn_page_state(lambda st: st.get("task")), 10)
+                            state = state or probe_earn_page(driver)
 
-                    try:
-                        # 限定在“每日签到”这一行查找对应的按钮/状态，避免其它行干扰
-                        claim_btns = driver.find_elements(By.XPATH, "//span[contains(text(),'每日签到')]/following::a[contains(@href,'/account/reward/earn')][1]")
-                        if any(el.is_displayed() for el in claim_btns):
-                            logger.info("检测到‘每日签到’行的‘领取奖励’，进入签到流程")
-                        else:
-                            completed = driver.find_elements(By.XPATH, "//span[contains(text(),'每日签到')]/following::span[contains(text(),'已完成')][1]")
-                            if any(el.is_displayed() for el in completed):
+                            # 限定在“每日签到”这一行查找对应的按钮/状态，避免其它行干扰
+                            if state.get("claimable"):
+                                logger.info("检测到‘每日签到’行的‘领取奖励’，进入签到流程")
+                            elif state.get("completed"):
                                 logger.info("‘每日签到’显示已完成，跳过当前账号")
-                                try:
-                                    points_raw = driver.find_element(By.XPATH, '//*[@id="app"]/div[1]/div[3]/div[2]/div/div/div[2]/div[1]/div[1]/div/p/div/h3').get_attribute("textContent")
-                                    current_points = int(''.join(re.findall(r'\d+', points_raw)))
-                                except:
-                                    current_points = 0
-                                return True, user, current_points, None
-                    except Exception:
-                        pass
+                                return True, user, state.get("points") or 0, None
 
-                    strategies = [
-                        (By.XPATH, '//*[@id="app"]/div[1]/div[3]/div[2]/div/div/div[2]/div[2]/div/div/div/div[1]/div/div[1]/div/div[1]/div/span[2]/a'),
-                        (By.XPATH, '//a[contains(@href, "earn") and contains(text(), "赚取")]'),
-                        (By.CSS_SELECTOR, 'a[href*="earn"]')
-                    ]
-                    
-                    earn = None
-                    for by, selector in strategies:
-                        try:
-                            earn = wait.until(EC.element_to_be_clickable((by, selector)))
-                            break
-                        except: continue
+                            earn = None
+                            if state.get("earn_link", -1) >= 0:
+                                earn = driver.find_element(*EARN_LINK_STRATEGIES[state["earn_link"]])
                     
-                    if earn:
-                        driver.execute_script("arguments[0].scrollIntoView(true);", earn)
-                        time.sleep(1)
-                        logger.info("点击赚取积分")
-                        driver.execute_script("arguments[0].click();", earn)
+                            if earn:
+                                driver.execute_script("arguments[0].scrollIntoView(true);", earn)
+                                wait_for(session, "earn_scroll", EC.element_to_be_clickable(earn), 2)
+                                logger.info("点击赚取积分")
+                                driver.execute_script("arguments[0].click();", earn)
                         
-                        # --- 核心修复：点击后等待，确保验证码 iframe 有时间加载 ---
-                        logger.info("等待验证码加载（如果有）...")
+                                # --- 核心修复：点击后等待，确保验证码 iframe 有时间加载 ---
+                                logger.info("等待验证码加载（如果有）...")
                         
-                        try:
-                            WebDriverWait(driver, 15, poll_frequency=0.25).until(
-                                EC.visibility_of_element_located((By.ID, "tcaptcha_iframe_dy"))
-                            )
-                            wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tcaptcha_iframe_dy")))
-                            logger.info("处理验证码")
-                            process_captcha()
-                            driver.switch_to.default_content()
-                        except TimeoutException:
-                            logger.info("未触发验证码，继续")
-                            driver.switch_to.default_content()
-                        except Exception as e:
-                            logger.error(f"验证码处理过程出错: {e}")
-                            driver.switch_to.default_content()
+                                try:
+                                    # 验证码弹出，或“每日签到”直接变成已完成
+                                    state = wait_for(session, "earn_response", earn_page_state(
+                                        lambda st: st.get("captcha") or st.get("completed")), 15)
+                                    if not state or not state.get("captcha"):
+                                        raise TimeoutException()
+                                    wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "tcaptcha_iframe_dy")))
+                                    logger.info("处理验证码")
+                                    result = process_captcha(session)
+                                    if not result.success:
+                                        captcha_failure = f"验证码未通过: {result.outcome}"
+                                    driver.switch_to.default_content()
+                                except TimeoutException:
+                                    logger.info("未触发验证码，继续")
+                                    driver.switch_to.default_content()
+                                except Exception as e:
+                                    logger.error(f"验证码处理过程出错: {e}")
+                                    captcha_failure = f"验证码处理过程出错: {e}"
+                                    driver.switch_to.default_content()
                         
-                        logger.info("赚取积分操作完成")
-                        break
-                    else:
-                        driver.refresh()
-                        time.sleep(3)
-                except Exception as e:
-                    logger.error(f"出错: {e}")
-                    time.sleep(3)
+                                if captcha_failure:
+                                    logger.error(f"赚取积分失败，{captcha_failure}")
+                                else:
+                                    logger.info("赚取积分操作完成")
+                                break
+                            else:
+                                driver.refresh()
+                                wait_for(session, "earn_refresh", page_ready, 10)
+                        except Exception as e:
+                            logger.error(f"出错: {e}")
+                            wait_for(session, "earn_retry", page_ready, 10)
             
-            driver.implicitly_wait(5)
-            # 简单的积分获取（不对比，保持原逻辑）
-            try:
-                points_raw = driver.find_element(By.XPATH, '//*[@id="app"]/div[1]/div[3]/div[2]/div/div/div[2]/div[1]/div[1]/div/p/div/h3').get_attribute("textContent")
-                current_points = int(''.join(re.findall(r'\d+', points_raw)))
-                logger.info(f"当前剩余积分: {current_points} | 约为 {current_points / 2000:.2f} 元")
-            except:
-                current_points = 0
+                with trace.span("points_scrape"):
+                    # 简单的积分获取（不对比，保持原逻辑）
+                    try:
+                        state = wait_for(session, "points", earn_page_state(lambda st: st.get("points") is not None), 5)
+                        current_points = state["points"] if state else 0
+                        if state:
+                            logger.info(f"当前剩余积分: {current_points} | 约为 {current_points / 2000:.2f} 元")
+                    except Exception:
+                        current_points = 0
                 
-            logger.info("任务执行成功！")
-            return True, user, current_points, None
-        else:
-            return False, user, 0, "登录失败"
+                if captcha_failure:
+                    return False, user, current_points, captcha_failure
+                logger.info("任务执行成功！")
+                return True, user, current_points, None
+            elif login_captcha is not None and not login_captcha.success:
+                return False, user, 0, f"登录失败，验证码未通过: {login_captcha.outcome}"
+            else:
+                return False, user, 0, "登录失败"
 
     except Exception as e:
         logger.error(f"异常: {str(e)}", exc_info=True)
         return False, user, 0, str(e)
     finally:
-        if driver:
-            try: driver.quit()
-            except: pass
+        if session is not None and session.waits:
+            logger.info(f"页面等待耗时: {wait_report(session.waits)}")
+        if session is not None and session.network is not None:
+            logger.info(f"网络: {session.network.report()}")
+        if session is not None and session.resources is not None:
+            with _account_resources_lock:
+                ACCOUNT_RESOURCES[user] = session.resources
+            logger.info(f"资源占用: {format_resources(session.resources)}")
+        if own_pool:
+            pool.close()
 
 if __name__ == "__main__":
     is_github_actions = os.environ.get("GITHUB_ACTIONS", "false") == "true"
@@ -448,12 +2480,12 @@ if __name__ == "__main__":
     headless = os.environ.get('HEADLESS', 'false').lower() == 'true'
     if is_github_actions: headless = True
     
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    logger = logging.getLogger(__name__)
-    
-    ocr = None
-    det = None
-    wait = None
+    # 同时处理的账户数；并发时日志带上线程名以区分账户
+    concurrency = max(1, int(os.environ.get("RAINYUN_CONCURRENCY", "1")))
+    log_format = '%(asctime)s - %(levelname)s - %(message)s'
+    if concurrency > 1:
+        log_format = '%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_format)
 
     ver = "2.2 (Fix)"
     logger.info("------------------------------------------------------------------")
@@ -473,12 +2505,33 @@ if __name__ == "__main__":
         logger.error("未找到有效账户配置或数量不匹配")
         exit(1)
     
-    results = []
-    for i, (user, pwd) in enumerate(accounts, 1):
+    def run_account(item):
+        i, (user, pwd) = item
         logger.info(f"\n=== 开始处理第 {i} 个账户: {user} ===")
-        result = sign_in_account(user, pwd, debug=debug, headless=headless)
-        results.append(result)
+        result = sign_in(user, pwd, debug=debug, headless=headless, pool=pool)
         logger.info(f"=== 第 {i} 个账户处理完成 ===\n")
+        return result
+
+    # 浏览器池至少要能同时借出 concurrency 个实例；结果按账户顺序汇总
+    concurrency = min(concurrency, len(accounts))
+    pool = BrowserPool(max(BROWSER_POOL_SIZE, concurrency), BROWSER_MAX_USES, debug=debug, headless=headless)
+    try:
+        if concurrency > 1:
+            logger.info(f"并发处理账户，并发数 {concurrency}")
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="account") as executor:
+                results = list(executor.map(run_account, enumerate(accounts, 1)))
+        else:
+            results = [run_account(item) for item in enumerate(accounts, 1)]
+    finally:
+        pool.close()
+    logger.info(f"共启动 Chrome {pool.launched} 次，处理 {len(accounts)} 个账户")
+    TRACE_EXPORTER.write_prometheus()
+    if ACCOUNT_RESOURCES:
+        logger.info("各账户浏览器资源占用（chromedriver + Chrome 全部进程）:")
+        for user, stats in ACCOUNT_RESOURCES.items():
+            logger.info(f"  {user}: {format_resources(stats)}")
+        logger.info(f"  所有账户中的最高峰值 RSS {max(s['peak_rss_mb'] for s in ACCOUNT_RESOURCES.values()):.0f} MB，"
+                    f"CPU 合计 {sum(s['cpu_s'] for s in ACCOUNT_RESOURCES.values()):.1f}s")
     
     # 生成统一通知
     success_count = sum(1 for r in results if r[0])
@@ -501,6 +2554,7 @@ if __name__ == "__main__":
     
     # 发送统一通知
     try:
+        send = load_notify()
         send(notification_title, notification_content)
         logger.info("统一通知发送成功")
     except Exception as e: